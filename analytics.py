@@ -0,0 +1,51 @@
+import pandas as pd
+from shift_calendar import period_key, recent_periods
+from database import refresh_period_rollups, get_period_rollups
+
+MIX_COLUMNS = {'am_count': 'AM可', 'pm_count': 'PM可', 'full_day_count': '1日可'}
+
+
+# (year, month) までの直近 months 期間の期間キー（古い順）
+def analytics_periods(year, month, months):
+    return [period_key(y, m) for y, m in recent_periods(year, month, months)]
+
+
+# 集計が古い期間だけSQLで作り直してから、期間ごとの集計を読む
+def load_rollups(periods):
+    refresh_period_rollups(periods)
+    return get_period_rollups(periods)
+
+
+# 期間×従業員のシフト日数（シフトのない期間も0の行で出す）
+def shift_days_by_period(rollups, periods, employees):
+    totals = rollups[rollups['store'] == '']
+    table = totals.pivot_table(index='period', columns='employee', values='day_weight', aggfunc='sum', fill_value=0)
+    return table.reindex(index=periods, columns=employees, fill_value=0).rename_axis(index='期間', columns=None)
+
+
+# 店舗×従業員のヘルプ日数（1日の重みを同じ日に入った店舗数で按分）
+def helper_days_by_store(rollups, employees, stores):
+    by_store = rollups[rollups['store'] != '']
+    table = by_store.pivot_table(index='store', columns='employee', values='day_weight', aggfunc='sum', fill_value=0)
+    order = [store for store in stores if store in table.index] + [store for store in table.index if store not in stores]
+    return table.reindex(index=order, columns=employees, fill_value=0).rename_axis(index='店舗', columns=None)
+
+
+# 店舗ごとのヘルプ希望の充足率（その日にヘルプが1人でも入っていれば充足）
+def fill_rate_by_store(fills, stores):
+    totals = fills.groupby('store')[['requests', 'filled']].sum()
+    order = [store for store in stores if store in totals.index] + [store for store in totals.index if store not in stores]
+    totals = totals.reindex(order)
+    return pd.DataFrame({
+        '希望日数': totals['requests'],
+        '充足日数': totals['filled'],
+        '充足率': totals['filled'] / totals['requests'],
+    }).rename_axis('店舗')
+
+
+# 従業員ごとのAM可・PM可・1日可の日数と割合
+def shift_mix(rollups, employees):
+    totals = rollups[rollups['store'] == ''].groupby('employee')[list(MIX_COLUMNS)].sum()
+    totals = totals.reindex(employees, fill_value=0).rename(columns=MIX_COLUMNS)
+    shares = totals.div(totals.sum(axis=1).where(lambda total: total > 0), axis=0).fillna(0)
+    return totals.join(shares.add_suffix('(割合)')).rename_axis('従業員')
@@ -0,0 +1,109 @@
+import pandas as pd
+import shift_model
+from registry import get_registry
+from shift_model import AVAILABILITY_WINDOWS
+from shift_calendar import period_range
+from coverage import compute_coverage_gaps, format_interval
+from database import get_store_help_request_rows, get_shift_segments, save_shifts_bulk
+from utils import calculate_shift_count
+
+MIN_ASSIGNMENT_MINUTES = 30
+PROPOSAL_COLUMNS = ['date', 'employee', 'store', 'start_min', 'end_min', 'time']
+
+
+# 区間の一覧から別の区間の一覧を取り除く
+def subtract_intervals(intervals, removed):
+    result = []
+    for start, end in intervals:
+        pieces = [(start, end)]
+        for removed_start, removed_end in removed:
+            pieces = [piece for piece_start, piece_end in pieces
+                      for piece in ((piece_start, min(piece_end, removed_start)), (max(piece_start, removed_end), piece_end))
+                      if piece[1] - piece[0] > 0]
+        result.extend(pieces)
+    return result
+
+
+# その日の従業員ごとの空き時間・担当エリアを求める
+def _daily_availability(row, store_areas):
+    availability = {}
+    for employee, shift_str in row.items():
+        shift = shift_model.parse(shift_str)
+        window = AVAILABILITY_WINDOWS.get(shift.shift_type)
+        if window is None:
+            continue
+        busy = [(segment.start, segment.end) for segment in shift.segments
+                if segment.start is not None and segment.end is not None]
+        areas = {store_areas.get(segment.store) for segment in shift.store_segments}
+        availability[employee] = {'free': subtract_intervals([window], busy), 'areas': areas - {None}}
+    return availability
+
+
+# 不足区間を空いている従業員に割り当てる貪欲法
+# 候補の少ない不足区間から順に、最も長く覆える従業員（同じ長さなら割り当て時間・シフト日数が少ない人）を選ぶ。
+# 覆いきれなかった残りは再びキューに戻す。
+def propose_assignments(shift_data, gaps, min_minutes=MIN_ASSIGNMENT_MINUTES):
+    shift_counts = calculate_shift_count(shift_data)
+    assigned_minutes = {employee: 0 for employee in shift_data.columns}
+    store_areas = get_registry().store_areas
+    availability_by_date = {date: _daily_availability(shift_data.loc[date], store_areas) for date in gaps['date'].unique()
+                            if date in shift_data.index}
+
+    def candidates(date, store, start, end):
+        area = store_areas.get(store)
+        result = []
+        for employee, availability in availability_by_date.get(date, {}).items():
+            if availability['areas'] and area not in availability['areas']:
+                continue  # 同じ日に別エリアへの移動は提案しない
+            for free_start, free_end in availability['free']:
+                overlap = min(end, free_end) - max(start, free_start)
+                if overlap >= min_minutes:
+                    result.append((overlap, employee, max(start, free_start), min(end, free_end)))
+        return result
+
+    queue = [(row.date, row.store, int(row.start_min), int(row.end_min)) for row in gaps.itertuples(index=False)]
+    queue.sort(key=lambda gap: (len(candidates(*gap)), gap[2] - gap[3]))
+
+    proposals = []
+    while queue:
+        date, store, start, end = queue.pop(0)
+        options = candidates(date, store, start, end)
+        if not options:
+            continue
+        _, employee, assign_start, assign_end = max(
+            options, key=lambda option: (option[0], -assigned_minutes[option[1]], -shift_counts.get(option[1], 0)))
+
+        availability = availability_by_date[date][employee]
+        availability['free'] = subtract_intervals(availability['free'], [(assign_start, assign_end)])
+        availability['areas'].add(store_areas.get(store))
+        assigned_minutes[employee] += assign_end - assign_start
+        proposals.append((date, employee, store, assign_start, assign_end, format_interval(assign_start, assign_end)))
+
+        for rest_start, rest_end in subtract_intervals([(start, end)], [(assign_start, assign_end)]):
+            if rest_end - rest_start >= min_minutes:
+                queue.append((date, store, rest_start, rest_end))
+
+    return pd.DataFrame(proposals, columns=PROPOSAL_COLUMNS).sort_values(['date', 'start_min', 'store'], ignore_index=True)
+
+
+# 割り当て案を既存のシフト文字列に追記した (date, employee, shift) の行にする
+def proposal_shift_rows(shift_data, proposals):
+    rows = []
+    for (date, employee), group in proposals.groupby(['date', 'employee'], sort=False):
+        shift = shift_model.parse(shift_data.loc[date, employee])
+        segments = sorted([(segment.start if segment.start is not None else -1, segment.time, segment.store) for segment in shift.segments] +
+                          [(row.start_min, row.time, row.store) for row in group.itertuples(index=False)])
+        rows.append((date, employee, shift_model.format_shift_str(shift.shift_type, [(time, store) for _, time, store in segments])))
+    return pd.DataFrame(rows, columns=['date', 'employee', 'shift'])
+
+
+# 期間（16日〜翌月15日）の割り当て案を作成
+def build_assignment_proposal(shift_data, year, month):
+    start_date, end_date = period_range(year, month)
+    gaps = compute_coverage_gaps(get_store_help_request_rows(start_date, end_date), get_shift_segments(start_date, end_date))
+    return propose_assignments(shift_data, gaps)
+
+
+# 割り当て案を1トランザクションで保存
+def apply_assignment_proposal(shift_data, proposals):
+    return save_shifts_bulk(proposal_shift_rows(shift_data, proposals))
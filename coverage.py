@@ -0,0 +1,103 @@
+import pandas as pd
+from shift_model import parse_time_range
+from shift_calendar import period_range, calendar_for_dates
+from database import get_store_help_request_rows, get_shift_segments
+
+GAP_COLUMNS = ['date', 'store', 'start_min', 'end_min', 'minutes']
+
+
+# 分を「9」「9半」「9:15」形式の時刻に戻す
+def minutes_to_label(minutes):
+    hour, minute = divmod(int(minutes), 60)
+    if minute == 0:
+        return str(hour)
+    if minute == 30:
+        return f'{hour}半'
+    return f'{hour}:{minute:02d}'
+
+
+def format_interval(start_min, end_min):
+    return f'{minutes_to_label(start_min)}-{minutes_to_label(end_min)}'
+
+
+# ヘルプ希望の時間帯（「9-18」「8半-12,14-18」など）を分の区間に変換（'-'や解析できない時間は無視）
+def parse_help_time(help_time):
+    if not isinstance(help_time, str):
+        return []
+    intervals = []
+    for part in help_time.replace('、', ',').split(','):
+        part = part.strip()
+        if not part or part == '-':
+            continue
+        start, end = parse_time_range(part)
+        if start is not None and end is not None and start < end:
+            intervals.append((start, end))
+    return intervals
+
+
+# 希望区間のうち、どの担当区間にも覆われていない部分をスイープラインで求める
+def uncovered_intervals(requested, assigned):
+    events = [(start, 0, 1) for start, _ in requested] + [(end, 0, -1) for _, end in requested]
+    events += [(start, 1, 1) for start, _ in assigned] + [(end, 1, -1) for _, end in assigned]
+    events.sort()
+
+    gaps = []
+    requested_count = assigned_count = 0
+    previous = None
+    for position, kind, delta in events:
+        if previous is not None and position > previous and requested_count > 0 and assigned_count == 0:
+            if gaps and gaps[-1][1] == previous:
+                gaps[-1] = (gaps[-1][0], position)
+            else:
+                gaps.append((previous, position))
+        if kind == 0:
+            requested_count += delta
+        else:
+            assigned_count += delta
+        previous = position
+    return gaps
+
+
+# 店舗・日付ごとの不足区間を求める
+# requestsは (date, store, help_time)、segmentsは get_shift_segments の (date, store, start_min, end_min, ...) 形式
+def compute_coverage_gaps(requests, segments):
+    requested = {}
+    for row in requests.itertuples(index=False):
+        intervals = parse_help_time(row.help_time)
+        if intervals:
+            requested.setdefault((row.date, row.store), []).extend(intervals)
+    if not requested:
+        return pd.DataFrame(columns=GAP_COLUMNS)
+
+    assigned = {}
+    for row in segments.itertuples(index=False):
+        key = (row.date, row.store)
+        if key in requested and pd.notna(row.start_min) and pd.notna(row.end_min) and row.start_min < row.end_min:
+            assigned.setdefault(key, []).append((int(row.start_min), int(row.end_min)))
+
+    gaps = [(date, store, start, end, end - start)
+            for (date, store), intervals in requested.items()
+            for start, end in uncovered_intervals(intervals, assigned.get((date, store), []))]
+    return pd.DataFrame(gaps, columns=GAP_COLUMNS).sort_values(['date', 'store', 'start_min'], ignore_index=True)
+
+
+# 期間（16日〜翌月15日）の全店舗の不足区間
+def get_coverage_gaps(year, month):
+    start_date, end_date = period_range(year, month)
+    return compute_coverage_gaps(get_store_help_request_rows(start_date, end_date),
+                                 get_shift_segments(start_date, end_date))
+
+
+# 表示用に日付・店舗ごとに不足時間帯をまとめる
+def coverage_gap_report(gaps):
+    if gaps.empty:
+        return pd.DataFrame(columns=['日付', '曜日', '店舗', '不足時間帯', '不足(時間)'])
+    gaps = gaps.assign(time=[format_interval(start, end) for start, end in zip(gaps['start_min'], gaps['end_min'])])
+    report = gaps.groupby(['date', 'store'], sort=True).agg(time=('time', ', '.join), minutes=('minutes', 'sum')).reset_index()
+    return pd.DataFrame({
+        '日付': report['date'].dt.strftime('%Y-%m-%d'),
+        '曜日': calendar_for_dates(report['date'])['曜日'].to_numpy(),
+        '店舗': report['store'],
+        '不足時間帯': report['time'],
+        '不足(時間)': report['minutes'] / 60,
+    })
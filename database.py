@@ -1,7 +1,12 @@
-import sqlite3
 import pandas as pd
 import os
-from constants import AREAS
+import contextvars
+from contextlib import contextmanager
+from datetime import datetime
+from constants import AREAS, EMPLOYEES, STORE_COLORS
+import shift_model
+from shift_calendar import period_key, period_key_of, period_range
+from storage import create_backend
 
 # ローカル環境とStreamlit Cloud環境を区別
 if os.environ.get('STREAMLIT_CLOUD'):
@@ -9,79 +14,742 @@ if os.environ.get('STREAMLIT_CLOUD'):
 else:
     DB_NAME = 'shifts.db'  # ローカルの場合はカレントディレクトリに作成
 
-# データベース初期化時
+# 拠点（テナント）ごとにDBファイルを分け、書き込みロックを拠点間で共有しない
+# 既定の拠点は従来どおり DB_NAME を使い、それ以外は同じ場所の shifts_<拠点>.db を使う
+TENANTS = {
+    'kagoshima': '鹿児島',
+    'miyazaki': '宮崎',
+}
+DEFAULT_TENANT = 'kagoshima'
+
+_current_tenant = contextvars.ContextVar('tenant', default=DEFAULT_TENANT)
+
+# 以降のDB操作の対象とする拠点を切り替える（スレッド・非同期タスクごとに独立）
+def set_tenant(tenant):
+    if tenant not in TENANTS:
+        raise ValueError(f'未登録の拠点です: {tenant}')
+    _current_tenant.set(tenant)
+
+def current_tenant():
+    return _current_tenant.get()
+
+# with文の中だけ拠点を切り替える
+@contextmanager
+def use_tenant(tenant):
+    if tenant not in TENANTS:
+        raise ValueError(f'未登録の拠点です: {tenant}')
+    token = _current_tenant.set(tenant)
+    try:
+        yield
+    finally:
+        _current_tenant.reset(token)
+
+# 拠点のDBファイルのパス
+def db_path(tenant=None):
+    tenant = tenant or current_tenant()
+    if tenant == DEFAULT_TENANT:
+        return DB_NAME
+    return os.path.join(os.path.dirname(DB_NAME), f'shifts_{tenant}.db')
+
+# 保存先（DATABASE_URLがあればPostgreSQL、なければ拠点ごとのSQLiteファイル）
+BACKEND = create_backend(os.environ.get('DATABASE_URL'), db_path)
+
+# 現在の拠点の接続を返す（with文で使うとコミット/ロールバックされる）
+def get_connection():
+    return BACKEND.connection(current_tenant())
+
+# 接続を閉じる（SQLiteは全ファイルのプールの使われていない接続、PostgreSQLはプール全体）
+def close_connections():
+    BACKEND.close()
+
+# クエリ結果をDataFrameにする（バックエンドに関係なく同じ列・型で返す）
+def _read_frame(conn, query, params=()):
+    cursor = conn.execute(query, params)
+    return pd.DataFrame(cursor.fetchall(), columns=[column[0] for column in cursor.description])
+
+INSERT_SHIFT_SEGMENT_QUERY = """
+INSERT INTO shift_segments (date, employee, start_min, end_min, store, time)
+VALUES (?, ?, ?, ?, ?, ?)
+"""
+
+UPSERT_SHIFT_QUERY = """
+INSERT INTO shifts (date, employee, shift, shift_type, period)
+VALUES (?, ?, ?, ?, ?)
+ON CONFLICT(date, employee) DO UPDATE SET shift = excluded.shift, shift_type = excluded.shift_type
+"""
+
+UPSERT_STORE_HELP_REQUEST_QUERY = """
+INSERT INTO store_help_requests (date, store, help_time, period)
+VALUES (?, ?, ?, ?)
+ON CONFLICT(date, store) DO UPDATE SET help_time = excluded.help_time
+"""
+
+# 集計に差分を足し込む（行がなければ差分そのものを入れる）
+APPLY_ROLLUP_DELTA_QUERY = """
+INSERT INTO period_rollups (period, employee, store, day_weight, am_count, pm_count, full_day_count)
+VALUES (?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT(period, employee, store) DO UPDATE SET
+    day_weight = period_rollups.day_weight + excluded.day_weight,
+    am_count = period_rollups.am_count + excluded.am_count,
+    pm_count = period_rollups.pm_count + excluded.pm_count,
+    full_day_count = period_rollups.full_day_count + excluded.full_day_count
+"""
+
+ROLLUP_COLUMNS = ['day_weight', 'am_count', 'pm_count', 'full_day_count']
+FILL_ROLLUP_COLUMNS = ['requests', 'filled']
+# 修復時に「ずれ」とみなす差（日数の按分による浮動小数点の誤差は無視する）
+ROLLUP_DRIFT_TOLERANCE = 1e-6
+
+BUMP_DATA_VERSION_QUERY = """
+INSERT INTO data_versions (period, version) VALUES (?, 1)
+ON CONFLICT(period) DO UPDATE SET version = data_versions.version + 1
+"""
+
+INSERT_CHANGE_LOG_QUERY = """
+INSERT INTO change_log (kind, date, key, value, changed_at, period, version)
+VALUES (?, ?, ?, ?, ?, ?, ?)
+"""
+
+# この日数より前の変更履歴は書き込みのたびに削除する（それより古いスナップショットは読み直しになる）
+CHANGE_LOG_RETENTION_DAYS = 30
+
+UPSERT_HISTORY_QUERY = """
+INSERT INTO history (kind, date, key, valid_from, value)
+VALUES (?, ?, ?, ?, ?)
+ON CONFLICT(kind, date, key, valid_from) DO UPDATE SET value = excluded.value
+"""
+
+# 履歴を取り始める前から入っていた値の valid_from
+HISTORY_EPOCH = '1970-01-01T00:00:00.000000'
+
+# 変更履歴（change_log）の種類
+CHANGE_KIND_SHIFT = 'shift'
+CHANGE_KIND_HELP_REQUEST = 'help_request'
+CHANGE_KIND_MASTER = 'master'
+
+# 従業員・店舗・エリアのマスタの更新番号（data_versionsの期間キーと重ならないキー）
+REGISTRY_VERSION_KEY = 'registry'
+
+MASTER_TABLE_COLUMNS = {
+    'employees': ['name', 'sort_order', 'active'],
+    'areas': ['name', 'sort_order', 'active'],
+    'stores': ['name', 'area', 'sort_order', 'color', 'active'],
+}
+
+# データベース初期化時（全拠点のDBを作成・移行する）
 def init_db():
     if os.environ.get('STREAMLIT_CLOUD'):
         os.makedirs('/app/data', exist_ok=True)
-    with sqlite3.connect(DB_NAME) as conn:
-        c = conn.cursor()
-        c.execute('''
+    for tenant in TENANTS:
+        with use_tenant(tenant):
+            _init_tenant_db()
+
+def _init_tenant_db():
+    with get_connection() as conn:
+        BACKEND.prepare_tenant(conn, current_tenant())
+        conn.execute('''
             CREATE TABLE IF NOT EXISTS shifts
             (date TEXT, employee TEXT, shift TEXT, PRIMARY KEY (date, employee))
         ''')
-        c.execute('''
+        conn.execute('''
             CREATE TABLE IF NOT EXISTS store_help_requests
             (date TEXT, store TEXT, help_time TEXT, PRIMARY KEY (date, store))
         ''')
+        # シフト文字列の「時間@店舗」を1行ずつに正規化したテーブル
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS shift_segments
+            (date TEXT, employee TEXT, start_min INTEGER, end_min INTEGER, store TEXT, time TEXT)
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_shift_segments_store_date ON shift_segments (store, date)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_shift_segments_date ON shift_segments (date, employee)')
+        # 期間（16日〜翌月15日）ごとの更新番号。書き込みのたびに増え、キャッシュキーに使う
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS data_versions
+            (period TEXT PRIMARY KEY, version INTEGER NOT NULL)
+        ''')
+        # 書き込みのたびに追記する変更履歴
+        # period・versionは書き込みで増えた期間の更新番号。番号の続きから読むとその後の変更だけを取り出せる
+        # （seqはコミット前に採番されるため、PostgreSQLでは小さいseqが後から見えることがあり続きの位置には使えない）
+        conn.execute(f'''
+            CREATE TABLE IF NOT EXISTS change_log
+            (seq {BACKEND.serial_primary_key}, kind TEXT NOT NULL, date TEXT, key TEXT, value TEXT,
+             changed_at TEXT NOT NULL)
+        ''')
+        # セルごとの値の版。valid_from以降その値だった（as_ofの時点の表を組み立てるのに使う）
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS history
+            (kind TEXT NOT NULL, date TEXT NOT NULL, key TEXT NOT NULL, valid_from TEXT NOT NULL, value TEXT,
+             PRIMARY KEY (kind, date, key, valid_from))
+        ''')
+        # 期間ごとの集計（分析ページ用）。rollup_versionsのversionがdata_versionsと違う期間は作り直す
+        # storeが''の行は従業員の期間合計、それ以外は店舗ごとのヘルプ日数（1日の重みを店舗数で按分）
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS period_rollups
+            (period TEXT NOT NULL, employee TEXT NOT NULL, store TEXT NOT NULL, day_weight REAL NOT NULL,
+             am_count INTEGER NOT NULL, pm_count INTEGER NOT NULL, full_day_count INTEGER NOT NULL,
+             PRIMARY KEY (period, employee, store))
+        ''')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS store_fill_rollups
+            (period TEXT NOT NULL, store TEXT NOT NULL, requests INTEGER NOT NULL, filled INTEGER NOT NULL,
+             PRIMARY KEY (period, store))
+        ''')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS rollup_versions
+            (period TEXT PRIMARY KEY, version INTEGER NOT NULL)
+        ''')
+        # 従業員・店舗・エリアのマスタ（並び順・色・有効フラグ）
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS employees
+            (name TEXT PRIMARY KEY, sort_order INTEGER NOT NULL, active INTEGER NOT NULL DEFAULT 1)
+        ''')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS areas
+            (name TEXT PRIMARY KEY, sort_order INTEGER NOT NULL, active INTEGER NOT NULL DEFAULT 1)
+        ''')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS stores
+            (name TEXT PRIMARY KEY, area TEXT NOT NULL, sort_order INTEGER NOT NULL,
+             color TEXT NOT NULL DEFAULT '#000000', active INTEGER NOT NULL DEFAULT 1)
+        ''')
+        migrate_db(conn)
+
+# 既存のshifts.dbをスキーマバージョンごとに一度だけ移行
+def _migrate_shift_segments(conn):
+    conn.execute('DELETE FROM shift_segments')
+    rows = []
+    for date_str, employee, shift_str in conn.execute('SELECT date, employee, shift FROM shifts'):
+        rows.extend(_shift_segment_rows(date_str, employee, shift_str))
+    conn.executemany(INSERT_SHIFT_SEGMENT_QUERY, rows)
+
+# constants.pyの従業員・店舗・エリアをマスタの初期値として登録
+def _migrate_master_tables(conn):
+    _insert_master_rows(conn, 'employees', [(name, i, 1) for i, name in enumerate(EMPLOYEES)])
+    areas = [area for area in AREAS.keys() if area != 'なし']
+    _insert_master_rows(conn, 'areas', [(area, i, 1) for i, area in enumerate(areas)])
+    _insert_master_rows(conn, 'stores', [(store, area, i, STORE_COLORS.get(store, '#000000'), 1)
+                                         for area in areas for i, store in enumerate(AREAS[area])])
+
+# 既存のシフト・店舗ヘルプ希望を履歴の最初の版として登録
+def _migrate_history(conn):
+    for kind, query in [(CHANGE_KIND_SHIFT, 'SELECT date, employee, shift FROM shifts'),
+                        (CHANGE_KIND_HELP_REQUEST, 'SELECT date, store, help_time FROM store_help_requests')]:
+        conn.executemany(UPSERT_HISTORY_QUERY, [(kind, date_str, key, HISTORY_EPOCH, value)
+                                                for date_str, key, value in conn.execute(query).fetchall()])
+
+# 期間ごとにSQLで集計できるよう、シフトに種類と期間、店舗ヘルプ希望に期間の列を追加
+def _migrate_period_columns(conn):
+    conn.execute('ALTER TABLE shifts ADD COLUMN shift_type TEXT')
+    conn.execute('ALTER TABLE shifts ADD COLUMN period TEXT')
+    conn.execute('ALTER TABLE store_help_requests ADD COLUMN period TEXT')
+    conn.executemany('UPDATE shifts SET shift_type = ?, period = ? WHERE date = ? AND employee = ?',
+                     [(shift_model.parse(shift_str).shift_type, period_key_of(date_str), date_str, employee)
+                      for date_str, employee, shift_str in conn.execute('SELECT date, employee, shift FROM shifts').fetchall()])
+    conn.executemany('UPDATE store_help_requests SET period = ? WHERE date = ? AND store = ?',
+                     [(period_key_of(date_str), date_str, store)
+                      for date_str, store in conn.execute('SELECT date, store FROM store_help_requests').fetchall()])
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_shifts_period ON shifts (period, employee)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_store_help_requests_period ON store_help_requests (period, store)')
+
+# 変更履歴を期間の更新番号で読めるようにする（移行前の行は番号がないため、そこをまたぐ読み込みは読み直しになる）
+def _migrate_change_log_versions(conn):
+    conn.execute('ALTER TABLE change_log ADD COLUMN period TEXT')
+    conn.execute('ALTER TABLE change_log ADD COLUMN version INTEGER')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_change_log_period ON change_log (period, version)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_change_log_changed_at ON change_log (changed_at)')
+
+MIGRATIONS = [
+    _migrate_shift_segments,  # 1: shift_segmentsの作成
+    _migrate_master_tables,  # 2: 従業員・店舗・エリアのマスタの作成
+    _migrate_history,  # 3: 履歴の作成
+    _migrate_period_columns,  # 4: 集計用の種類・期間の列の追加
+    _migrate_change_log_versions,  # 5: 変更履歴への期間・更新番号の列の追加
+]
+
+def migrate_db(conn):
+    version = BACKEND.get_schema_version(conn)
+    for target_version, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+        migration(conn)
+        BACKEND.set_schema_version(conn, target_version)
+
+def _shift_segment_rows(date_str, employee, shift_str):
+    return [(date_str, employee, segment.start, segment.end, segment.store, segment.time)
+            for segment in shift_model.parse(shift_str).store_segments]
+
+# 書き込んだ日付が属する期間の更新番号を増やし、増やした後の番号を {期間: 番号} で返す
+def _bump_data_versions(conn, records):
+    periods = sorted({period_key_of(date_str) for date_str, _, _ in records})
+    conn.executemany(BUMP_DATA_VERSION_QUERY, [(period,) for period in periods])
+    rows = conn.execute(f"SELECT period, version FROM data_versions WHERE period IN ({', '.join('?' * len(periods))})",
+                        tuple(periods)).fetchall()
+    return dict(rows)
+
+# 期間の更新番号（未更新の期間は0）
+def get_data_version(year, month):
+    with get_connection() as conn:
+        row = conn.execute('SELECT version FROM data_versions WHERE period = ?',
+                           (period_key(year, month),)).fetchone()
+    return row[0] if row else 0
+
+def _insert_master_rows(conn, table, rows):
+    columns = MASTER_TABLE_COLUMNS[table]
+    updates = ', '.join(f'{column} = excluded.{column}' for column in columns[1:])
+    conn.executemany(f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))}) "
+                     f"ON CONFLICT(name) DO UPDATE SET {updates}", rows)
+
+# マスタの更新番号（未更新なら0）
+def get_registry_version():
+    with get_connection() as conn:
+        row = conn.execute('SELECT version FROM data_versions WHERE period = ?', (REGISTRY_VERSION_KEY,)).fetchone()
+    return row[0] if row else 0
 
-def get_shifts(start_date, end_date):
+# 従業員・エリア・店舗のマスタを並び順どおりに返す {テーブル名: DataFrame}
+def get_master_tables():
+    with get_connection() as conn:
+        return {table: _read_frame(conn, f"SELECT {', '.join(columns)} FROM {table} ORDER BY sort_order, name")
+                for table, columns in MASTER_TABLE_COLUMNS.items()}
+
+# マスタを丸ごと置き換えて更新番号を増やす（{テーブル名: DataFrame} の一部だけ渡してもよい）
+def save_master_tables(tables):
+    with get_connection() as conn:
+        for table, df in tables.items():
+            columns = MASTER_TABLE_COLUMNS[table]
+            df = df.dropna(subset=['name'])
+            df = df[df['name'].astype(str).str.strip() != ''].drop_duplicates(subset='name', keep='last')
+            # 画面からはactiveがbool、並び順が小数で来ることがある（PostgreSQLはbool→integerを自動で変換しない）
+            df = df.astype({'sort_order': int, 'active': int})
+            conn.execute(f'DELETE FROM {table}')
+            _insert_master_rows(conn, table, list(df[columns].astype(object).itertuples(index=False, name=None)))
+        conn.execute(BUMP_DATA_VERSION_QUERY, (REGISTRY_VERSION_KEY,))
+        _log_changes(conn, CHANGE_KIND_MASTER, [(None, table, None) for table in tables])
+
+# 変更履歴に (日付文字列, キー, 値) を追記する（書き込みと同じトランザクションで呼ぶ）
+# versionsは_bump_data_versionsが返した {期間: 番号}。日付のある変更はセルの新しい版として履歴にも残す
+def _log_changes(conn, kind, records, versions=None):
+    now = datetime.now()
+    changed_at = now.isoformat(timespec='microseconds')
+    versions = versions or {}
+    rows = []
+    for date_str, key, value in records:
+        period = period_key_of(date_str) if date_str is not None else None
+        rows.append((kind, date_str, key, value, changed_at, period, versions.get(period)))
+    conn.executemany(INSERT_CHANGE_LOG_QUERY, rows)
+    conn.execute('DELETE FROM change_log WHERE changed_at < ?',
+                 ((now - pd.Timedelta(days=CHANGE_LOG_RETENTION_DAYS)).isoformat(timespec='microseconds'),))
+    conn.executemany(UPSERT_HISTORY_QUERY, [(kind, date_str, key, changed_at, value)
+                                            for date_str, key, value in records if date_str is not None])
+
+# as_ofの時点で有効だった版を (date, key, value) で返す
+# 主キー (kind, date, key, valid_from) の範囲だけを読むので、期間外の履歴は走査しない
+def _history_as_of(conn, kind, start_date_str, end_date_str, as_of):
+    query = """
+    SELECT h.date, h.key, h.value
+    FROM history h
+    WHERE h.kind = ? AND h.date BETWEEN ? AND ?
+      AND h.valid_from = (SELECT MAX(valid_from) FROM history
+                          WHERE kind = h.kind AND date = h.date AND key = h.key AND valid_from <= ?)
+    """
+    return _read_frame(conn, query, (kind, start_date_str, end_date_str, pd.Timestamp(as_of).isoformat(timespec='microseconds')))
+
+# セルの版の一覧（新しい順）
+def get_history(kind, date, key):
+    query = 'SELECT valid_from, value FROM history WHERE kind = ? AND date = ? AND key = ? ORDER BY valid_from DESC'
+    with get_connection() as conn:
+        df = _read_frame(conn, query, (kind, pd.Timestamp(date).strftime('%Y-%m-%d'), key))
+    df['valid_from'] = pd.to_datetime(df['valid_from'])
+    return df
+
+# beforeより前の版は、セルごとにbefore時点で有効だった最後の版だけを残して削除し、削除件数を返す
+# （before以降のas_ofは変わらず再現でき、それより前は粗くなる）
+def compact_history(before):
+    before_str = pd.Timestamp(before).isoformat(timespec='microseconds')
+    query = """
+    DELETE FROM history
+    WHERE valid_from < ?
+      AND valid_from < (SELECT MAX(h.valid_from) FROM history h
+                        WHERE h.kind = history.kind AND h.date = history.date AND h.key = history.key
+                          AND h.valid_from < ?)
+    """
+    with get_connection() as conn:
+        return conn.execute(query, (before_str, before_str)).rowcount
+
+# 期間の更新番号が after_version より後、version までの変更を古い順に返す（シフト・ヘルプ希望の両方）
+# 同じ期間への書き込みはdata_versionsの行で1つずつになるため、番号が見えていればそれ以前の変更はすべて見える
+# 途中の番号の変更がない（削除済み・移行前の書き込み）場合はNoneを返すので、呼び出し側で読み直すこと
+def get_period_changes(year, month, after_version, version):
+    query = """
+    SELECT seq, kind, date, key, value, changed_at, version
+    FROM change_log
+    WHERE period = ? AND version > ? AND version <= ?
+    ORDER BY version, seq
+    """
+    with get_connection() as conn:
+        changes = _read_frame(conn, query, (period_key(year, month), after_version, version))
+    if set(changes['version']) != set(range(after_version + 1, version + 1)):
+        return None
+    return changes
+
+# 日付×従業員のシフト表にシフトの変更を反映した新しい表を返す（元の表は変更しない）
+def merge_shift_changes(snapshot, changes):
+    merged = snapshot.copy()
+    for change in changes[changes['kind'] == CHANGE_KIND_SHIFT].itertuples(index=False):
+        date = pd.Timestamp(change.date)
+        if date in merged.index and change.key in merged.columns:
+            merged.at[date, change.key] = change.value
+    return merged
+
+# as_ofを指定すると、その時点のシフトを履歴から組み立てる
+def get_shifts(start_date, end_date, as_of=None):
     start_date_str = start_date.strftime('%Y-%m-%d')
     end_date_str = end_date.strftime('%Y-%m-%d')
     
-    with sqlite3.connect(DB_NAME) as conn:
-        query = """
-        SELECT date, employee, shift
-        FROM shifts
-        WHERE date BETWEEN ? AND ?
-        """
-        df = pd.read_sql_query(query, conn, params=(start_date_str, end_date_str))
+    with get_connection() as conn:
+        if as_of is not None:
+            df = _history_as_of(conn, CHANGE_KIND_SHIFT, start_date_str, end_date_str, as_of)
+            df.columns = ['date', 'employee', 'shift']
+        else:
+            query = """
+            SELECT date, employee, shift
+            FROM shifts
+            WHERE date BETWEEN ? AND ?
+            """
+            df = _read_frame(conn, query, (start_date_str, end_date_str))
     
     df['date'] = pd.to_datetime(df['date'])
     return df.pivot(index='date', columns='employee', values='shift')
 
 def save_shift(date, employee, shift_str):
-    date_str = date.strftime('%Y-%m-%d')
-    
-    with sqlite3.connect(DB_NAME) as conn:
-        cursor = conn.cursor()
-        query = """
-        INSERT OR REPLACE INTO shifts (date, employee, shift)
-        VALUES (?, ?, ?)
-        """
-        cursor.execute(query, (date_str, employee, shift_str))
+    save_shifts_bulk([(date, employee, shift_str)])
+
+# DataFrameまたは (日付, キー, 値) の行を (日付文字列, キー, 値) に揃える
+# DataFrameは date/キー/値 列を持つ縦持ち形式か、日付×キーの横持ち形式（ヘルプ表と同じ形）を受け付ける
+# 横持ち形式は日付の列（日付）か日付のインデックスが必要。形式が合わない場合はValueError
+def _iter_records(rows, key_column, value_column):
+    if isinstance(rows, pd.DataFrame):
+        if 'date' in rows.columns:
+            missing = [column for column in (key_column, value_column) if column not in rows.columns]
+            if missing:
+                raise ValueError(f'date列のある表には {key_column}/{value_column} 列が必要です（不足: {", ".join(missing)}）')
+            rows = rows[['date', key_column, value_column]].itertuples(index=False, name=None)
+        else:
+            if '日付' in rows.columns:
+                frame = rows.set_index('日付')
+            elif isinstance(rows.index, pd.DatetimeIndex):
+                frame = rows
+            else:
+                raise ValueError('日付×名前の表には「日付」列か日付のインデックスが必要です')
+            frame = frame.drop(columns=['曜日'], errors='ignore')
+            rows = frame.stack().reset_index().itertuples(index=False, name=None)
+    for date, key, value in rows:
+        if pd.isna(value):
+            continue
+        yield pd.Timestamp(date).strftime('%Y-%m-%d'), str(key), str(value).strip()
+
+# マスタ（employees・stores）に登録されていない名前があれば、何も書き込まずにValueError
+def _check_master_names(conn, table, records):
+    known = {row[0] for row in conn.execute(f'SELECT name FROM {table}').fetchall()}
+    unknown = sorted({key for _, key, _ in records} - known)
+    if unknown:
+        raise ValueError(f'マスタに登録されていない名前があります: {", ".join(unknown)}')
+
+# 同じ (日付, キー) が複数ある場合は後の行を優先
+def _dedupe_records(records):
+    return list({(date_str, key): (date_str, key, value) for date_str, key, value in records}.values())
+
+# シフトの行（save_shifts_bulk と同じ形式）を重複を除いた (日付文字列, 従業員, シフト文字列) にする
+def shift_records(rows):
+    return _dedupe_records(_iter_records(rows, 'employee', 'shift'))
+
+# シフトをまとめて1トランザクションで保存し、保存件数を返す
+def save_shifts_bulk(rows):
+    records = shift_records(rows)
+    if not records:
+        return 0
+    segment_rows = [segment_row for date_str, employee, shift_str in records
+                    for segment_row in _shift_segment_rows(date_str, employee, shift_str)]
+
+    periods = sorted({period_key_of(date_str) for date_str, _, _ in records})
+
+    with get_connection() as conn:
+        _check_master_names(conn, 'employees', records)
+        # 先に期間の更新番号を増やしてから書き込み前の値を読む（同じ期間への書き込みはここで1つずつになる）
+        BACKEND.begin_write(conn)
+        versions = _bump_data_versions(conn, records)
+        current_periods = _current_rollup_periods(conn, periods, bumped=True)
+        stored = _stored_shifts(conn, records) if current_periods else {}
+        conn.executemany(UPSERT_SHIFT_QUERY, [(date_str, employee, shift_str, shift_model.parse(shift_str).shift_type,
+                                               period_key_of(date_str))
+                                              for date_str, employee, shift_str in records])
+        conn.executemany('DELETE FROM shift_segments WHERE date = ? AND employee = ?',
+                         [(date_str, employee) for date_str, employee, _ in records])
+        conn.executemany(INSERT_SHIFT_SEGMENT_QUERY, segment_rows)
+        _apply_rollup_deltas(conn, current_periods, stored, records)
+        _sync_rollups(conn, current_periods, _touched_stores(stored, records))
+        _log_changes(conn, CHANGE_KIND_SHIFT, records, versions)
+    return len(records)
+
+# 店舗（省略時は全店舗）のヘルプ区間をインデックス経由で取得
+def get_shift_segments(start_date, end_date, store=None):
+    start_date_str = start_date.strftime('%Y-%m-%d')
+    end_date_str = end_date.strftime('%Y-%m-%d')
+
+    query = """
+    SELECT date, employee, start_min, end_min, store, time
+    FROM shift_segments
+    WHERE date BETWEEN ? AND ?
+    """
+    params = [start_date_str, end_date_str]
+    if store is not None:
+        query += " AND store = ?"
+        params.append(store)
+    query += " ORDER BY date, start_min"
+
+    with get_connection() as conn:
+        df = _read_frame(conn, query, params)
+
+    df['date'] = pd.to_datetime(df['date'])
+    return df
 
 def save_store_help_request(date, store, help_time):
-    date_str = date.strftime('%Y-%m-%d')
-    
-    with sqlite3.connect(DB_NAME) as conn:
-        cursor = conn.cursor()
-        query = """
-        INSERT OR REPLACE INTO store_help_requests (date, store, help_time)
-        VALUES (?, ?, ?)
-        """
-        cursor.execute(query, (date_str, store, help_time))
-
-def get_store_help_requests(start_date, end_date):
+    save_store_help_requests_bulk([(date, store, help_time)])
+
+# 店舗ヘルプ希望をまとめて1トランザクションで保存し、保存件数を返す
+def save_store_help_requests_bulk(rows):
+    records = _dedupe_records(_iter_records(rows, 'store', 'help_time'))
+    if not records:
+        return 0
+
+    period_stores = {}
+    for date_str, store, _ in records:
+        period_stores.setdefault(period_key_of(date_str), set()).add(store)
+
+    with get_connection() as conn:
+        _check_master_names(conn, 'stores', records)
+        BACKEND.begin_write(conn)
+        versions = _bump_data_versions(conn, records)
+        current_periods = _current_rollup_periods(conn, sorted(period_stores), bumped=True)
+        conn.executemany(UPSERT_STORE_HELP_REQUEST_QUERY, [(date_str, store, help_time, period_key_of(date_str))
+                                                           for date_str, store, help_time in records])
+        _sync_rollups(conn, current_periods, period_stores)
+        _log_changes(conn, CHANGE_KIND_HELP_REQUEST, records, versions)
+    return len(records)
+
+# 店舗ヘルプ希望を (date, store, help_time) の縦持ちで取得（as_ofを指定するとその時点の値）
+def get_store_help_request_rows(start_date, end_date, as_of=None):
     start_date_str = start_date.strftime('%Y-%m-%d')
     end_date_str = end_date.strftime('%Y-%m-%d')
     
-    with sqlite3.connect(DB_NAME) as conn:
-        query = """
-        SELECT date, store, help_time
-        FROM store_help_requests
-        WHERE date BETWEEN ? AND ?
-        """
-        df = pd.read_sql_query(query, conn, params=(start_date_str, end_date_str))
+    with get_connection() as conn:
+        if as_of is not None:
+            df = _history_as_of(conn, CHANGE_KIND_HELP_REQUEST, start_date_str, end_date_str, as_of)
+            df.columns = ['date', 'store', 'help_time']
+        else:
+            query = """
+            SELECT date, store, help_time
+            FROM store_help_requests
+            WHERE date BETWEEN ? AND ?
+            """
+            df = _read_frame(conn, query, (start_date_str, end_date_str))
     
     df['date'] = pd.to_datetime(df['date'])
+    return df
+
+def get_store_help_requests(start_date, end_date, stores):
+    df = get_store_help_request_rows(start_date, end_date)
     
     # ピボットテーブルを作成し、欠損値を'-'で埋める
     pivot_df = df.pivot(index='date', columns='store', values='help_time').fillna('-')
     
     # 全ての店舗列が存在することを確認
-    all_stores = [store for stores in AREAS.values() for store in stores]
-    for store in all_stores:
+    for store in stores:
         if store not in pivot_df.columns:
             pivot_df[store] = '-'
     
-    return pivot_df
\ No newline at end of file
+    return pivot_df
+
+# シフトの種類ごとの日数の重み（shift_model.SHIFT_WEIGHTSと同じ値をSQLで計算する）
+def _shift_weight_sql(column):
+    cases = ' '.join(f"WHEN '{shift_type}' THEN {weight}" for shift_type, weight in shift_model.SHIFT_WEIGHTS.items())
+    return f'(CASE {column} {cases} ELSE 0 END)'
+
+def _shift_type_count_sql(column, shift_type):
+    return f"SUM(CASE WHEN {column} = '{shift_type}' THEN 1 ELSE 0 END)"
+
+# 1期間分の集計をSQLで作り直す（shifts・shift_segments・store_help_requestsから）
+def _rebuild_period_rollups(conn, period):
+    year, month = int(period[:4]), int(period[5:])
+    start_date, end_date = period_range(year, month)
+    date_range = (start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d'))
+    weight = _shift_weight_sql('s.shift_type')
+    counts = ', '.join(_shift_type_count_sql('s.shift_type', shift_type) for shift_type in ('AM可', 'PM可', '1日可'))
+
+    row = conn.execute('SELECT version FROM data_versions WHERE period = ?', (period,)).fetchone()
+    version = row[0] if row else 0
+    conn.execute('DELETE FROM period_rollups WHERE period = ?', (period,))
+    conn.execute(f"""
+        INSERT INTO period_rollups (period, employee, store, day_weight, am_count, pm_count, full_day_count)
+        SELECT s.period, s.employee, '', SUM({weight}), {counts}
+        FROM shifts s
+        WHERE s.period = ?
+        GROUP BY s.period, s.employee
+    """, (period,))
+    conn.execute(f"""
+        INSERT INTO period_rollups (period, employee, store, day_weight, am_count, pm_count, full_day_count)
+        SELECT s.period, c.employee, c.store, SUM({weight} * 1.0 / n.stores), {counts}
+        FROM (SELECT DISTINCT date, employee, store FROM shift_segments WHERE date BETWEEN ? AND ?) c
+        JOIN (SELECT date, employee, COUNT(DISTINCT store) AS stores FROM shift_segments
+              WHERE date BETWEEN ? AND ? GROUP BY date, employee) n
+          ON n.date = c.date AND n.employee = c.employee
+        JOIN shifts s ON s.date = c.date AND s.employee = c.employee
+        GROUP BY s.period, c.employee, c.store
+    """, date_range + date_range)
+    _rebuild_fill_rollups(conn, period)
+    conn.execute('INSERT INTO rollup_versions (period, version) VALUES (?, ?) '
+                 'ON CONFLICT(period) DO UPDATE SET version = excluded.version', (period, version))
+
+# 店舗ヘルプ希望の充足の集計を作り直す（stores省略時は期間の全店舗）
+def _rebuild_fill_rollups(conn, period, stores=None):
+    store_filter, params = '', (period,)
+    if stores is not None:
+        store_filter = f" AND store IN ({', '.join('?' * len(stores))})"
+        params += tuple(stores)
+    conn.execute(f'DELETE FROM store_fill_rollups WHERE period = ?{store_filter}', params)
+    conn.execute(f"""
+        INSERT INTO store_fill_rollups (period, store, requests, filled)
+        SELECT period, store, COUNT(*),
+               SUM(CASE WHEN EXISTS (SELECT 1 FROM shift_segments g WHERE g.date = r.date AND g.store = r.store)
+                        THEN 1 ELSE 0 END)
+        FROM store_help_requests r
+        WHERE period = ?{store_filter} AND help_time NOT IN ('-', '')
+        GROUP BY period, store
+    """, params)
+
+def rebuild_period_rollups(period):
+    with get_connection() as conn:
+        _rebuild_period_rollups(conn, period)
+
+# シフト1セル分の集計への寄与 [(期間, 従業員, 店舗, 日数, AM可, PM可, 1日可)]（sign=-1で取り消し）
+def _shift_rollup_rows(date_str, employee, shift_str, sign=1):
+    shift = shift_model.parse(shift_str)
+    period = period_key_of(date_str)
+    counts = tuple(sign * int(shift.shift_type == shift_type) for shift_type in ('AM可', 'PM可', '1日可'))
+    rows = [(period, employee, '', sign * shift.weight) + counts]
+    stores = sorted({segment.store for segment in shift.store_segments})
+    rows += [(period, employee, store, sign * shift.weight / len(stores)) + counts for store in stores]
+    return rows
+
+# 集計が最新の（集計後に書き込みのない）期間
+# bumped=True は書き込み中のトランザクションで更新番号を増やした後に呼ぶ場合（集計は1つ前の番号なら最新）
+def _current_rollup_periods(conn, periods, bumped=False):
+    placeholders = ', '.join('?' * len(periods))
+    rows = conn.execute(f"""
+        SELECT r.period FROM rollup_versions r
+        LEFT JOIN data_versions d ON d.period = r.period
+        WHERE r.period IN ({placeholders}) AND r.version + ? = COALESCE(d.version, 0)
+    """, (*periods, int(bumped))).fetchall()
+    return {row[0] for row in rows}
+
+# 書き込み前のシフトの値 {(日付文字列, 従業員): シフト}
+def _stored_shifts(conn, records):
+    dates = [date_str for date_str, _, _ in records]
+    employees = sorted({employee for _, employee, _ in records})
+    rows = conn.execute(f"""
+        SELECT date, employee, shift FROM shifts
+        WHERE date BETWEEN ? AND ? AND employee IN ({', '.join('?' * len(employees))})
+    """, (min(dates), max(dates), *employees)).fetchall()
+    return {(date_str, employee): shift_str for date_str, employee, shift_str in rows}
+
+# 書き込みと同じトランザクションで、最新の集計に古い値を引いて新しい値を足す
+# 集計が古い期間は触らない（読み込み時に作り直される）
+def _apply_rollup_deltas(conn, current_periods, stored, records):
+    delta_rows = []
+    for date_str, employee, shift_str in records:
+        if period_key_of(date_str) not in current_periods:
+            continue
+        if (date_str, employee) in stored:
+            delta_rows += _shift_rollup_rows(date_str, employee, stored[(date_str, employee)], sign=-1)
+        delta_rows += _shift_rollup_rows(date_str, employee, shift_str)
+    conn.executemany(APPLY_ROLLUP_DELTA_QUERY, delta_rows)
+
+# 書き込みの前後でヘルプ区間に出てくる店舗 {期間: {店舗}}（充足の集計を作り直す範囲）
+def _touched_stores(stored, records):
+    period_stores = {}
+    for date_str, employee, shift_str in records:
+        stores = period_stores.setdefault(period_key_of(date_str), set())
+        for value in (stored.get((date_str, employee)), shift_str):
+            stores.update(segment.store for segment in shift_model.parse(value).store_segments)
+    return period_stores
+
+# 書き込んだ (期間, 店舗) の充足の集計を作り直し、集計の版を更新後のdata_versionsにそろえる
+def _sync_rollups(conn, current_periods, period_stores):
+    for period in sorted(current_periods):
+        stores = sorted(period_stores.get(period, ()))
+        if stores:
+            _rebuild_fill_rollups(conn, period, stores)
+    conn.executemany('UPDATE rollup_versions SET version = (SELECT version FROM data_versions d WHERE d.period = ?) '
+                     'WHERE period = ?', [(period, period) for period in sorted(current_periods)])
+
+# 集計が古い（集計後に書き込みがあった）期間だけを作り直し、作り直した期間を返す
+def refresh_period_rollups(periods):
+    placeholders = ', '.join('?' * len(periods))
+    with get_connection() as conn:
+        data_versions = dict(conn.execute(f'SELECT period, version FROM data_versions WHERE period IN ({placeholders})',
+                                          tuple(periods)).fetchall())
+        rollup_versions = dict(conn.execute(f'SELECT period, version FROM rollup_versions WHERE period IN ({placeholders})',
+                                            tuple(periods)).fetchall())
+    stale = [period for period in periods if rollup_versions.get(period) != data_versions.get(period, 0)]
+    for period in stale:
+        rebuild_period_rollups(period)
+    return stale
+
+def _read_rollups(conn, periods):
+    placeholders = ', '.join('?' * len(periods))
+    rollups = _read_frame(conn, f"""
+        SELECT period, employee, store, {', '.join(ROLLUP_COLUMNS)}
+        FROM period_rollups WHERE period IN ({placeholders})
+    """, tuple(periods))
+    fills = _read_frame(conn, f"""
+        SELECT period, store, {', '.join(FILL_ROLLUP_COLUMNS)}
+        FROM store_fill_rollups WHERE period IN ({placeholders})
+    """, tuple(periods))
+    return rollups, fills
+
+# 期間の一覧の集計を (period_rollups, store_fill_rollups) で返す
+def get_period_rollups(periods):
+    with get_connection() as conn:
+        return _read_rollups(conn, periods)
+
+# 保存されていた集計と作り直した集計の差を (表, 期間, キー, 列, 保存値, 再計算値) の行で返す
+def _rollup_drift(table, keys, columns, stored, expected):
+    merged = stored.merge(expected, on=keys, how='outer', suffixes=('_stored', '_expected'))
+    drift = []
+    for column in columns:
+        values = merged[[f'{column}_stored', f'{column}_expected']].astype(float).fillna(0)
+        differs = (values[f'{column}_stored'] - values[f'{column}_expected']).abs() > ROLLUP_DRIFT_TOLERANCE
+        for index in merged.index[differs]:
+            drift.append((table, merged.at[index, 'period'], '/'.join(str(merged.at[index, key]) or '合計' for key in keys[1:]),
+                          column, values.at[index, f'{column}_stored'], values.at[index, f'{column}_expected']))
+    return drift
+
+# 集計を生の行から作り直し、作り直す前の集計とのずれを返す（periods省略時は全期間）
+# 作り直す前から古かった期間は読み込み時に作り直されるため、ずれには含めない
+def repair_period_rollups(periods=None):
+    with get_connection() as conn:
+        if periods is None:
+            periods = sorted({row[0] for row in conn.execute("""
+                SELECT period FROM shifts WHERE period IS NOT NULL
+                UNION SELECT period FROM store_help_requests WHERE period IS NOT NULL
+                UNION SELECT period FROM rollup_versions
+            """).fetchall()})
+        if not periods:
+            return pd.DataFrame(columns=['表', '期間', 'キー', '列', '保存値', '再計算値'])
+        current_periods = sorted(_current_rollup_periods(conn, periods))
+        stored_rollups, stored_fills = _read_rollups(conn, current_periods) if current_periods else (None, None)
+        for period in periods:
+            _rebuild_period_rollups(conn, period)
+        drift = []
+        if current_periods:
+            rollups, fills = _read_rollups(conn, current_periods)
+            drift += _rollup_drift('period_rollups', ['period', 'employee', 'store'], ROLLUP_COLUMNS, stored_rollups, rollups)
+            drift += _rollup_drift('store_fill_rollups', ['period', 'store'], FILL_ROLLUP_COLUMNS, stored_fills, fills)
+    return pd.DataFrame(drift, columns=['表', '期間', 'キー', '列', '保存値', '再計算値'])
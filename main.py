@@ -4,96 +4,212 @@ from datetime import datetime
 import io
 import base64
 import asyncio
-from database import init_db, get_shifts, save_shift, save_store_help_request, get_store_help_requests
-from pdf_generator import generate_help_table_pdf,generate_individual_pdf,generate_store_pdf
-from constants import EMPLOYEES, SHIFT_TYPES, STORE_COLORS, WEEKDAY_JA,AREAS
-from utils import parse_shift, format_shifts, update_session_state_shifts, highlight_weekend_and_holiday, highlight_filled_shifts
-@st.cache_data(ttl=3600)
-def get_cached_shifts(year, month):
-    start_date = pd.Timestamp(year, month, 16)
-    end_date = start_date + pd.DateOffset(months=1) - pd.Timedelta(days=1)
-    return get_shifts(start_date, end_date)
+import multiprocessing
+from shift_calendar import period_range, recent_periods, calendar_for_dates
+from database import init_db, get_master_tables, save_master_tables, get_shifts, save_shift, save_store_help_request, get_store_help_requests, get_shift_segments, save_shifts_bulk, save_store_help_requests_bulk, get_data_version, TENANTS, set_tenant, current_tenant, get_period_changes, merge_shift_changes, compact_history
+from pdf_cache import cached_help_table_pdf, cached_individual_pdf, cached_store_pdf
+from coverage import get_coverage_gaps, coverage_gap_report
+from assignment import build_assignment_proposal, apply_assignment_proposal, proposal_shift_rows
+from analytics import analytics_periods, load_rollups, shift_days_by_period, helper_days_by_store, fill_rate_by_store, shift_mix
+from validation import validate_shift, validate_shift_rows, validate_month
+from pdf_batch import export_pdfs_zip, export_pdfs_merged, individual_pdf_filename, store_pdf_filename
+from pdf_jobs import get_pdf_job_queue, JOB_DONE, JOB_STATUS_LABELS
+from constants import SHIFT_TYPES
+from registry import get_registry, pin_registry
+from utils import parse_shift, shift_formatter, highlight_weekend_and_holiday, highlight_filled_shifts, read_uploaded_table, build_html_table, combine_styles, build_covered_stores_index, build_display_frame, format_shift_text, diff_snapshots
+# 変更履歴から差分を反映する上限（これより多ければ読み直した方が速い）
+MAX_MERGED_CHANGES = 200
+# 他のセッションの変更を確認する間隔（秒）
+CHANGE_POLL_SECONDS = 5
+# 生成中のPDFの進み具合を確認する間隔（秒）
+PDF_JOB_POLL_SECONDS = 1
+
+# (拠点, 年, 月) → (更新番号, シフト表)。最後に組み立てたシフト表と、その期間の更新番号
+@st.cache_resource
+def month_snapshot_bases():
+    return {}
+
+def _read_only_frame(frame):
+    values = frame.to_numpy(dtype=object, copy=True)
+    values.flags.writeable = False
+    return pd.DataFrame(values, index=frame.index, columns=frame.columns, copy=False)
+
+# 月（16日〜翌月15日）の日付×従業員のシフト表を更新番号ごとに1度だけ組み立ててキャッシュする
+# 前の更新番号の表があれば、変更履歴からその後に変わったセルだけを反映する
+# 全セッションで同じオブジェクトを共有するため、値は読み取り専用にしている
+# 以下のキャッシュ関数の tenant は拠点ごとにキャッシュを分けるためのキー（読むDBは set_tenant 済みの拠点）
+@st.cache_resource(max_entries=24)
+def load_month_snapshot(tenant, year, month, data_version):
+    start_date, end_date = period_range(year, month)
+    employees = list(get_registry().employees)
+    bases = month_snapshot_bases()
+    base_version, base = bases.get((tenant, year, month), (None, None))
+
+    snapshot = None
+    if base is not None and list(base.columns) == employees and base_version <= data_version:
+        # 番号が飛んでいる（変更履歴が削除済みなど）場合はNoneになり、読み直す
+        changes = get_period_changes(year, month, base_version, data_version)
+        if changes is not None and len(changes) <= MAX_MERGED_CHANGES:
+            snapshot = _read_only_frame(merge_shift_changes(base, changes))
+    if snapshot is None:
+        # data_versionより後の変更が含まれることはあるが、次の更新番号で同じ値に上書きされるだけ
+        date_range = pd.date_range(start=start_date, end=end_date)
+        shifts = get_shifts(start_date, end_date)
+        snapshot = _read_only_frame(shifts.reindex(index=date_range, columns=employees).fillna('-'))
+
+    bases[(tenant, year, month)] = (data_version, snapshot)
+    return snapshot
+
+# 他のセッションの保存を定期的に確認し、表示中の期間が変わっていれば再実行する
+# 再実行してもシフト表は変わったセルを反映するだけなので軽い
+@st.experimental_fragment(run_every=CHANGE_POLL_SECONDS)
+def watch_changes(tenant, selected_year, selected_month):
+    # 部分的な再実行は別スレッドで動くことがあるため、拠点を設定し直す
+    set_tenant(tenant)
+    shown_version = st.session_state.data_version
+    latest_version = get_data_version(selected_year, selected_month)
+    if latest_version == shown_version:
+        return
+    changes = get_period_changes(selected_year, selected_month, shown_version, latest_version)
+    st.toast(f'他のユーザーが{len(changes)}件更新しました' if changes is not None else '他のユーザーが更新しました')
+    st.experimental_rerun()
+
+# PDFの生成をジョブに登録してこのセッションの一覧に加える（render(report) はワーカーで実行される）
+# renderからst.session_stateは読めないため、必要な値は登録前に取り出しておくこと
+def submit_pdf_job(kind, name, label, file_name, mime, render):
+    key = (kind, name, st.session_state.current_year, st.session_state.current_month,
+           st.session_state.data_version, get_registry().version)
+    job = get_pdf_job_queue().submit(key, label, file_name, mime, render)
+    job_ids = st.session_state.setdefault('pdf_job_ids', [])
+    if job.job_id not in job_ids:
+        job_ids.append(job.job_id)
+    st.experimental_rerun()
+
+# このセッションのジョブ（キューから捨てられたものは一覧から外す）
+def session_pdf_jobs():
+    queue = get_pdf_job_queue()
+    jobs = [job for job in map(queue.get, st.session_state.get('pdf_job_ids', [])) if job is not None]
+    st.session_state.pdf_job_ids = [job.job_id for job in jobs]
+    return jobs
+
+# 生成が終わったPDFのダウンロードボタン（生成中のものはwatch_pdf_jobsが表示する）
+def display_pdf_downloads():
+    jobs = session_pdf_jobs()
+    st.session_state.pending_pdf_job_ids = [job.job_id for job in jobs if not job.finished]
+    finished_jobs = [job for job in jobs if job.finished]
+    if not finished_jobs:
+        return
+    st.header('生成したPDF')
+    for job in finished_jobs:
+        if job.status == JOB_DONE:
+            st.download_button(label=f'{job.label}をダウンロード', data=job.data, file_name=job.file_name,
+                               mime=job.mime, key=f'download_{job.job_id}')
+        else:
+            st.error(f'{job.label}の生成に失敗しました: {job.error}')
+    if st.button('一覧を消去', key='clear_pdf_jobs'):
+        st.session_state.pdf_job_ids = st.session_state.pending_pdf_job_ids
+        st.experimental_rerun()
+
+# 生成中のPDFの進み具合を表示し、どれかが終わったら全体を再実行してダウンロードボタンを出す
+@st.experimental_fragment(run_every=PDF_JOB_POLL_SECONDS)
+def watch_pdf_jobs():
+    pending_ids = st.session_state.get('pending_pdf_job_ids', [])
+    if not pending_ids:
+        return
+    queue = get_pdf_job_queue()
+    pending_jobs = [queue.get(job_id) for job_id in pending_ids]
+    if any(job is None or job.finished for job in pending_jobs):
+        st.experimental_rerun()
+    for job in pending_jobs:
+        st.progress(job.progress, text=f'{job.label}: {JOB_STATUS_LABELS[job.status]}')
 
 async def save_shift_async(date, employee, shift_str):
     await asyncio.to_thread(save_shift, date, employee, shift_str)
-    
-    current_month = date.replace(day=1)
-    previous_month = current_month - pd.DateOffset(months=1)
-    get_cached_shifts.clear()
-    get_cached_shifts(current_month.year, current_month.month)
-    get_cached_shifts(previous_month.year, previous_month.month)
-    
     st.experimental_rerun()
 
-def initialize_shift_data(year, month):
-    if 'shift_data' not in st.session_state or st.session_state.current_year != year or st.session_state.current_month != month:
-        start_date = pd.Timestamp(year, month, 16)
-        end_date = start_date + pd.DateOffset(months=1) - pd.Timedelta(days=1)
-        date_range = pd.date_range(start=start_date, end=end_date)
-        st.session_state.shift_data = pd.DataFrame(
-            index=date_range,
-            columns=EMPLOYEES,
-            data='-'
-        )
-        st.session_state.current_year = year
-        st.session_state.current_month = month
-
-def calculate_shift_count(shift_data):
-    def count_shift(shift):
-        if pd.isna(shift) or shift == '-':
-            return 0
-        shift_type = shift.split(',')[0] if ',' in shift else shift
-        if shift_type in ['1日可', '鹿屋', 'かご北', 'リクルート']:
-            return 1
-        elif shift_type in ['AM可', 'PM可']:
-            return 0.5
-        return 0
-
-    return shift_data.applymap(count_shift).sum()
+# ヘルプ表1ページ分のHTMLを (年, 月, ページ, 更新番号) ごとにキャッシュする
+# 月のシフト表（変更履歴から差分を反映したもの）から表示するページの日付だけを切り出して整形する
+@st.cache_data(max_entries=256)
+def render_shift_table_page(tenant, year, month, page, items_per_page, data_version):
+    start_date, end_date = period_range(year, month)
+    page_start = start_date + pd.Timedelta(days=(page - 1) * items_per_page)
+    page_end = min(page_start + pd.Timedelta(days=items_per_page - 1), end_date)
+    page_dates = pd.date_range(start=page_start, end=page_end)
+    snapshot = load_month_snapshot(tenant, year, month, data_version)
+    page_data = build_display_frame(snapshot.loc[page_start:page_end], page_dates).reset_index(drop=True)
+    registry = get_registry()
+    styles = highlight_weekend_and_holiday(page_data)
+    return build_html_table(page_data, styles=styles, formatters=dict.fromkeys(registry.employees, shift_formatter(registry)))
+
+# スクロール表示用に直近 months 期間をテキスト化した表（versionsは各期間の更新番号）
+@st.cache_data(max_entries=16)
+def load_shift_grid_data(tenant, year, month, months, versions):
+    snapshot = load_period_range(year, month, months)
+    grid_data = build_display_frame(snapshot, snapshot.index).reset_index(drop=True)
+    employees = list(get_registry().employees)
+    grid_data[employees] = grid_data[employees].apply(lambda column: column.map(format_shift_text))
+    return grid_data
+
+# 日付→ヘルプに入っている店舗の集合を更新番号ごとにキャッシュする
+@st.cache_resource(max_entries=24)
+def load_covered_stores(tenant, year, month, data_version):
+    return build_covered_stores_index(load_month_snapshot(tenant, year, month, data_version))
+
+# 店舗ヘルプ希望のエリア別HTMLを (年, 月, 更新番号) ごとにキャッシュする（希望がなければNone）
+@st.cache_data(max_entries=64)
+def render_store_help_tables(tenant, year, month, data_version):
+    start_date, end_date = period_range(year, month)
+    areas = get_registry().areas
+    store_help_requests = get_store_help_requests(start_date, end_date, get_registry().stores)
+    if store_help_requests.empty:
+        return None
+
+    store_help_requests['日付'] = store_help_requests.index.strftime('%Y-%m-%d')
+    store_help_requests['曜日'] = calendar_for_dates(store_help_requests.index)['曜日'].to_numpy()
+    store_help_requests = store_help_requests.reset_index(drop=True)
+    covered_stores = load_covered_stores(tenant, year, month, data_version)
+
+    tables = {}
+    for area, area_stores in areas.items():
+        area_data = store_help_requests[['日付', '曜日'] + list(area_stores)].fillna('-')
+        styles = combine_styles(highlight_weekend_and_holiday(area_data), highlight_filled_shifts(area_data, covered_stores))
+        tables[area] = build_html_table(area_data, styles=styles)
+    return tables
+
+# 直近 months 期間のスナップショットを日付順に連結する
+def load_period_range(year, month, months):
+    return pd.concat([load_month_snapshot(current_tenant(), y, m, get_data_version(y, m)) for y, m in recent_periods(year, month, months)])
 
 def display_shift_table(selected_year, selected_month):
     st.header('ヘルプ表')
-    
-    # 選択された月の16日から開始
-    start_date = pd.Timestamp(selected_year, selected_month, 16)
-    # 翌月の15日まで
-    end_date = start_date + pd.DateOffset(months=1) - pd.Timedelta(days=1)
-    
-    # 日付範囲を作成
-    date_range = pd.date_range(start=start_date, end=end_date)
-    
-    # セッションステートからデータを取得し、必要な日付範囲のみを抽出
-    display_data = st.session_state.shift_data.loc[start_date:end_date].copy()
-    
-    # 存在しない日付があればその行を追加
-    for date in date_range:
-        if date not in display_data.index:
-            display_data.loc[date] = '-'
-    
-    # インデックスをソート
-    display_data = display_data.sort_index()
-    
-    # 日付と曜日のカラムを追加
-    display_data['日付'] = display_data.index.strftime('%Y-%m-%d')
-    display_data['曜日'] = display_data.index.strftime('%a').map(WEEKDAY_JA)
-    
-    # 存在しない従業員列を '-' で埋める
-    for employee in EMPLOYEES:
-        if employee not in display_data.columns:
-            display_data[employee] = '-'
-    
-    display_data = display_data[['日付', '曜日'] + EMPLOYEES]
-    display_data = display_data.fillna('-')
+    start_date, end_date = period_range(selected_year, selected_month)
+    total_days = (end_date - start_date).days + 1
+
+    view_mode = st.radio('表示形式', ['ページ', 'スクロール'], horizontal=True, key='shift_table_view_mode')
+    if view_mode == 'スクロール':
+        display_shift_grid(selected_year, selected_month)
+    else:
+        display_shift_table_pages(selected_year, selected_month, total_days)
+
+    display_shift_counts(selected_year, selected_month)
 
-    # シフトカウントを計算
-    shift_counts = calculate_shift_count(display_data[EMPLOYEES])
+# 連続スクロール表示（st.dataframeのグリッドは表示中の行だけを描画する）
+def display_shift_grid(selected_year, selected_month):
+    grid_months = st.radio('表示する期間', [1, 3, 6], format_func=lambda m: f'{m}か月', horizontal=True, key='grid_months')
+    grid_data = load_shift_grid_data(current_tenant(), selected_year, selected_month, grid_months,
+                                     tuple(get_data_version(y, m) for y, m in recent_periods(selected_year, selected_month, grid_months)))
+    st.dataframe(grid_data.style.apply(highlight_weekend_and_holiday, axis=None),
+                 use_container_width=True, hide_index=True, height=600)
 
+# ページ送りの表示（表示中のページだけを取得・整形する）
+def display_shift_table_pages(selected_year, selected_month, total_days):
     # ページネーションのコード（変更なし）
     items_per_page = 15
-    total_pages = len(display_data) // items_per_page + (1 if len(display_data) % items_per_page > 0 else 0)
+    total_pages = total_days // items_per_page + (1 if total_days % items_per_page > 0 else 0)
     
     if 'current_page' not in st.session_state:
         st.session_state.current_page = 1
+    st.session_state.current_page = min(st.session_state.current_page, total_pages)
 
     # ページナビゲーション（変更なし）
     col1, col2, col3 = st.columns([2,3,2])
@@ -110,11 +226,6 @@ def display_shift_table(selected_year, selected_month):
         if st.button('次へ ▶', key='next_page') and st.session_state.current_page < total_pages:
             st.session_state.current_page += 1
 
-    start_idx = (st.session_state.current_page - 1) * items_per_page
-    end_idx = start_idx + items_per_page
-
-    page_display_data = display_data.iloc[start_idx:end_idx]
-
     # CSSでテーブルのスタイルを調整（変更なし）
     st.markdown("""
     <style>
@@ -138,32 +249,45 @@ def display_shift_table(selected_year, selected_month):
     </style>
     """, unsafe_allow_html=True)
 
-    # インデックスをリセットし、不要な列を削除
-    page_display_data = page_display_data.reset_index(drop=True)
-
-    # スタイリングを適用
-    styled_df = page_display_data.style.format(format_shifts, subset=EMPLOYEES)\
-                                .apply(highlight_weekend_and_holiday, axis=1)
-    
-    # インデックスを表示せずにHTMLを生成
-    st.write(styled_df.hide(axis="index").to_html(escape=False), unsafe_allow_html=True)
+    # 表示中のページのHTML（キャッシュ済みならそのまま使う）
+    page_html = render_shift_table_page(current_tenant(), selected_year, selected_month, st.session_state.current_page,
+                                        items_per_page, st.session_state.data_version)
+    st.write(page_html, unsafe_allow_html=True)
 
+# シフト日数（保存時に差分で更新している期間ごとの集計を読むだけで、シフトは数え直さない）
+def display_shift_counts(selected_year, selected_month):
+    registry = get_registry()
+    employees = list(registry.employees)
     # シフトカウントを表示
     st.markdown("### シフト日数")
-    shift_count_df = pd.DataFrame([shift_counts], columns=EMPLOYEES)
-    styled_shift_count = shift_count_df.style.format("{:.1f}")\
+    count_months = st.radio('集計期間', [1, 3, 6, 12], format_func=lambda m: f'{m}か月', horizontal=True, key='count_months')
+    periods = analytics_periods(selected_year, selected_month, count_months)
+    rollups, _ = load_rollups(periods)
+    period_counts = shift_days_by_period(rollups, periods, employees)
+    if count_months == 1:
+        shift_count_df = period_counts.reset_index(drop=True)
+    else:
+        period_counts.loc['合計'] = period_counts.sum()
+        shift_count_df = period_counts.rename_axis('期間').reset_index()
+    styled_shift_count = shift_count_df.style.format("{:.1f}", subset=employees)\
                                              .set_properties(**{'class': 'shift-count'})
     st.write(styled_shift_count.hide(axis="index").to_html(escape=False), unsafe_allow_html=True)
 
-    # PDFダウンロードボタンを追加（変更なし）
-    if st.button("ヘルプ表をPDFでダウンロード"):
-        pdf = generate_help_table_pdf(display_data, selected_year, selected_month)
-        st.download_button(
-            label="ヘルプ表PDFをダウンロード",
-            data=pdf,
-            file_name=f"全ヘルプスタッフ_{selected_year}_{selected_month}.pdf",
-            mime="application/pdf"
-        )
+    with st.expander('店舗別ヘルプ日数'):
+        store_counts = helper_days_by_store(rollups, employees, registry.stores)
+        if store_counts.empty:
+            st.write("ヘルプ実績はありません。")
+        else:
+            store_counts['合計'] = store_counts.sum(axis=1)
+            st.dataframe(store_counts.style.format("{:.1f}"), use_container_width=True)
+
+    # PDFの生成はバックグラウンドで行い、できあがるとサイドバーにダウンロードボタンが出る
+    if st.button("ヘルプ表をPDFで生成"):
+        shift_data = st.session_state.shift_data
+        data_version = st.session_state.data_version
+        submit_pdf_job('help_table', '', 'ヘルプ表PDF', f"全ヘルプスタッフ_{selected_year}_{selected_month}.pdf", "application/pdf",
+                       lambda report: cached_help_table_pdf(build_display_frame(shift_data, shift_data.index),
+                                                            selected_year, selected_month, data_version))
 
 def initialize_session_state():
     if 'editing_shift' not in st.session_state:
@@ -180,6 +304,7 @@ def update_shift_input(current_shift, employee, date):
         st.session_state.editing_shift = True
     
     shift_type, times, stores = parse_shift(st.session_state.current_shift)
+    registry = get_registry()
     
     new_shift_type = st.selectbox('種類', ['AM可', 'PM可', '1日可', '-', '休み', '鹿屋', 'かご北', 'リクルート'], index=['AM可', 'PM可', '1日可', '-', '休み', '鹿屋', 'かご北', 'リクルート'].index(shift_type) if shift_type in ['AM可', 'PM可', '1日可', '休み', '鹿屋', 'かご北', 'リクルート'] else 3)
     
@@ -192,13 +317,14 @@ def update_shift_input(current_shift, employee, date):
             col1, col2, col3 = st.columns(3)
             with col1:
                 # エリアの選択肢を準備
-                area_options = list(AREAS.keys())
+                area_options = registry.area_options
                 # 既存のエリアがある場合はそれを選択、なければ最初の選択肢
-                current_area = next((area for area, stores_list in AREAS.items() if stores[i] in stores_list), area_options[0]) if i < len(stores) else area_options[0]
+                current_area = registry.store_areas.get(stores[i], area_options[0]) if i < len(stores) else area_options[0]
+                current_area = current_area if current_area in area_options else area_options[0]
                 area = st.selectbox(f'エリア {i+1}', area_options, index=area_options.index(current_area), key=f'shift_area_{i}')
                 
             with col2:
-                store_options = [''] + AREAS[area] if area != 'なし' else ['']
+                store_options = [''] + list(registry.areas[area]) if area != 'なし' else ['']
                 # 既存の店舗がある場合はそれを選択、なければ空白
                 current_store = stores[i] if i < len(stores) and stores[i] in store_options else ''
                 store = st.selectbox(f'店舗 {i+1}', store_options, index=store_options.index(current_store), key=f'shift_store_{i}')
@@ -235,27 +361,13 @@ def update_shift_input(current_shift, employee, date):
 def display_store_help_requests(selected_year, selected_month):
     st.header('店舗ヘルプ希望')
     
-    start_date = pd.Timestamp(selected_year, selected_month, 16)
-    end_date = start_date + pd.DateOffset(months=1) - pd.Timedelta(days=1)
+    area_tables = render_store_help_tables(current_tenant(), selected_year, selected_month, st.session_state.data_version)
     
-    store_help_requests = get_store_help_requests(start_date, end_date)
-    
-    if store_help_requests.empty:
+    if area_tables is None:
         st.write("ヘルプ希望はありません。")
     else:
-        store_help_requests['日付'] = store_help_requests.index.strftime('%Y-%m-%d')
-        store_help_requests['曜日'] = store_help_requests.index.strftime('%a').map(WEEKDAY_JA)
-        
-        # 存在しない店舗列を追加
-        all_stores = [store for stores in AREAS.values() for store in stores]
-        for store in all_stores:
-            if store not in store_help_requests.columns:
-                store_help_requests[store] = '-'
-        
-        store_help_requests = store_help_requests.reset_index(drop=True)
-
         # エリアごとにタブを作成（「なし」を除外）
-        area_tabs = [area for area in AREAS.keys() if area != 'なし']
+        area_tabs = list(area_tables.keys())
         tabs = st.tabs(area_tabs)
         
         # CSSでテーブルのスタイルを調整
@@ -279,22 +391,7 @@ def display_store_help_requests(selected_year, selected_month):
         
         for area, tab in zip(area_tabs, tabs):
             with tab:
-                area_stores = AREAS[area]
-                area_data = store_help_requests[['日付', '曜日'] + area_stores]
-                area_data = area_data.fillna('-')
-
-                # シフトデータを取得し、インデックスをDateTime型に変換
-                shift_data = st.session_state.shift_data[
-                    (st.session_state.shift_data.index >= start_date) & 
-                    (st.session_state.shift_data.index <= end_date)
-                ]
-                shift_data.index = pd.to_datetime(shift_data.index)
-
-                # スタイリングを適用
-                styled_df = area_data.style.apply(highlight_weekend_and_holiday, axis=1)\
-                                        .apply(highlight_filled_shifts, shift_data=shift_data, axis=1)
-
-                st.write(styled_df.to_html(escape=False, index=False), unsafe_allow_html=True)
+                st.write(area_tables[area], unsafe_allow_html=True)
 
         # CSVダウンロードボタンを追加
  #       csv = store_help_requests.to_csv(index=False).encode('utf-8-sig')
@@ -305,56 +402,271 @@ def display_store_help_requests(selected_year, selected_month):
  #           mime="text/csv",
  #       )
 
-def load_shift_data(year, month):
-    start_date = pd.Timestamp(year, month, 16)
-    end_date = start_date + pd.DateOffset(months=1) - pd.Timedelta(days=1)
-    shifts = get_shifts(start_date, end_date)
-    
-    # 日付範囲を作成
-    date_range = pd.date_range(start=start_date, end=end_date)
-    
-    # 全ての日付と従業員の組み合わせを持つDataFrameを作成
-    full_shifts = pd.DataFrame(index=date_range, columns=EMPLOYEES, data='-')
-    
-    # 取得したシフトデータで更新
-    full_shifts.update(shifts)
-    
-    st.session_state.shift_data = full_shifts
-    st.session_state.current_year = year
-    st.session_state.current_month = month
+def display_bulk_import():
+    st.header('一括取り込み')
+    import_kind = st.radio('取り込むデータ', ['シフト', '店舗ヘルプ希望'], key='import_kind')
+    uploaded_file = st.file_uploader('CSV / Excelファイル', type=['csv', 'xlsx'], key='import_file')
+    st.caption('1列目に日付、以降の列に従業員名（店舗名）を並べたヘルプ表と同じ形式、または date/employee/shift（date/store/help_time）列の形式')
+    if uploaded_file is None or not st.button('取り込む'):
+        return
+
+    try:
+        df = read_uploaded_table(uploaded_file)
+    except Exception as e:
+        st.error(f'ファイルを読み込めませんでした: {e}')
+        return
+
+    try:
+        if import_kind == 'シフト':
+            count = save_shifts_bulk(df)
+            st.session_state.saved_conflicts = ('一括取り込み', validate_shift_rows(df))
+        else:
+            count = save_store_help_requests_bulk(df)
+    except ValueError as e:
+        st.error(f'取り込めませんでした: {e}')
+        return
+    st.success(f'{count}件を取り込みました')
+    st.experimental_rerun()
+
+# 店舗ヘルプ希望に対して担当が足りていない時間帯の一覧
+@st.cache_data(max_entries=24)
+def load_coverage_gap_report(tenant, year, month, data_version):
+    return coverage_gap_report(get_coverage_gaps(year, month))
+
+def display_coverage_gaps(selected_year, selected_month):
+    st.header('ヘルプ不足時間帯')
+    report = load_coverage_gap_report(current_tenant(), selected_year, selected_month, st.session_state.data_version)
+    if report.empty:
+        st.write("不足している時間帯はありません。")
+        return
+    st.write(f"不足 {len(report)}件 / 合計 {report['不足(時間)'].sum():.1f}時間")
+    st.dataframe(report.style.format({'不足(時間)': "{:.1f}"}), use_container_width=True, hide_index=True)
+
+def display_assignment_proposal(selected_year, selected_month):
+    st.header('ヘルプ自動割り当て')
+    if st.button('割り当て案を作成'):
+        st.session_state.assignment_proposal = build_assignment_proposal(st.session_state.shift_data, selected_year, selected_month)
+        st.session_state.assignment_proposal_version = (current_tenant(), st.session_state.data_version)
+
+    proposal = st.session_state.get('assignment_proposal')
+    if proposal is None:
+        return
+    if st.session_state.get('assignment_proposal_version') != (current_tenant(), st.session_state.data_version):
+        st.warning('割り当て案の作成後にデータが更新されました。もう一度作成してください。')
+        return
+    if proposal.empty:
+        st.write("割り当てられる従業員がいません。")
+        return
+
+    st.dataframe(pd.DataFrame({
+        '日付': proposal['date'].dt.strftime('%Y-%m-%d'),
+        '従業員': proposal['employee'],
+        '店舗': proposal['store'],
+        '時間': proposal['time'],
+    }), use_container_width=True, hide_index=True)
+    if st.button('割り当て案を反映'):
+        count = apply_assignment_proposal(st.session_state.shift_data, proposal)
+        st.session_state.saved_conflicts = ('割り当て案の反映', validate_shift_rows(proposal_shift_rows(st.session_state.shift_data, proposal)))
+        del st.session_state.assignment_proposal
+        st.success(f'{count}件のシフトを更新しました')
+        st.experimental_rerun()
+
+# 1か月分の重複・受付時間外・エリア移動の一覧
+@st.cache_data(max_entries=24)
+def load_conflict_report(tenant, year, month, data_version):
+    start_date, end_date = period_range(year, month)
+    return validate_month(load_month_snapshot(tenant, year, month, data_version), get_shift_segments(start_date, end_date))
+
+# この日数より前の履歴は、セルごとに最後の版だけを残す
+HISTORY_RETENTION_DAYS = 90
+
+# 2つの時点のヘルプ表を履歴から組み立てて、変わったセルを表示する
+def display_snapshot_diff(selected_year, selected_month):
+    st.header('ヘルプ表の変更履歴')
+    now = datetime.now()
+    with st.expander('履歴の整理'):
+        st.caption(f'{HISTORY_RETENTION_DAYS}日より前の履歴は、各セルの最後の版だけを残して削除します')
+        if st.button('古い履歴を整理'):
+            count = compact_history(now - pd.Timedelta(days=HISTORY_RETENTION_DAYS))
+            st.success(f'{count}件の古い版を削除しました')
+    col1, col2 = st.columns(2)
+    with col1:
+        before_date = st.date_input('比較元の日付', value=now.date() - pd.Timedelta(days=7), key='diff_before_date')
+        before_time = st.time_input('比較元の時刻', value=datetime.min.time(), key='diff_before_time')
+    with col2:
+        after_date = st.date_input('比較先の日付', value=now.date(), key='diff_after_date')
+        after_time = st.time_input('比較先の時刻', value=now.time().replace(microsecond=0), key='diff_after_time')
+    if not st.button('比較する'):
+        return
+
+    start_date, end_date = period_range(selected_year, selected_month)
+    before = get_shifts(start_date, end_date, as_of=datetime.combine(before_date, before_time))
+    after = get_shifts(start_date, end_date, as_of=datetime.combine(after_date, after_time))
+    diff = diff_snapshots(before, after)
+    if diff.empty:
+        st.write("変更はありません。")
+        return
+    st.write(f"{len(diff)}件のセルが変更されています")
+    st.dataframe(diff, use_container_width=True, hide_index=True)
+
+def conflict_table(conflicts):
+    return pd.DataFrame({
+        '日付': conflicts['date'].dt.strftime('%Y-%m-%d'),
+        '従業員': conflicts['employee'],
+        '種類': conflicts['kind'],
+        '内容': conflicts['detail'],
+    })
+
+def display_conflicts(selected_year, selected_month):
+    st.header('シフトの整合性チェック')
+    conflicts = load_conflict_report(current_tenant(), selected_year, selected_month, st.session_state.data_version)
+    if conflicts.empty:
+        st.write("問題は見つかりませんでした。")
+        return
+    st.dataframe(conflict_table(conflicts), use_container_width=True, hide_index=True)
+
+# 一括取り込み・割り当て案の反映で書き込んだセルに見つかった問題（閉じるまで表示する）
+def display_saved_conflicts():
+    saved = st.session_state.get('saved_conflicts')
+    if saved is None:
+        return
+    label, conflicts = saved
+    if conflicts.empty:
+        del st.session_state.saved_conflicts
+        return
+    st.warning(f'{label}で書き込んだシフトに{len(conflicts)}件の問題があります')
+    st.dataframe(conflict_table(conflicts), use_container_width=True, hide_index=True)
+    if st.button('閉じる', key='clear_saved_conflicts'):
+        del st.session_state.saved_conflicts
+        st.experimental_rerun()
+
+# マスタを変更したときに、古い従業員・店舗・色で作られたキャッシュを捨てる
+# cache_resource全体は消さない（PDFのジョブキューなどマスタに関係しないものも入るため）
+def clear_registry_caches():
+    st.cache_data.clear()
+    for cached in (month_snapshot_bases, load_month_snapshot, load_covered_stores):
+        cached.clear()
+
+# 従業員・エリア・店舗のマスタ編集ページ
+def display_master_settings():
+    st.header('マスタ設定')
+    tables = get_master_tables()
+    for table in tables.values():
+        table['active'] = table['active'].astype(bool)
+
+    st.subheader('従業員')
+    employees = st.data_editor(tables['employees'], num_rows='dynamic', hide_index=True, key='master_employees',
+                               column_config={'name': '名前', 'sort_order': '並び順', 'active': st.column_config.CheckboxColumn('有効')})
+    st.subheader('エリア')
+    areas = st.data_editor(tables['areas'], num_rows='dynamic', hide_index=True, key='master_areas',
+                           column_config={'name': 'エリア', 'sort_order': '並び順', 'active': st.column_config.CheckboxColumn('有効')})
+    st.subheader('店舗')
+    stores = st.data_editor(tables['stores'], num_rows='dynamic', hide_index=True, key='master_stores',
+                            column_config={'name': '店舗', 'sort_order': '並び順',
+                                           'area': st.column_config.SelectboxColumn('エリア', options=areas['name'].dropna().tolist()),
+                                           'color': st.column_config.TextColumn('色', validate=r'^#[0-9A-Fa-f]{6}$'),
+                                           'active': st.column_config.CheckboxColumn('有効')})
+
+    if st.button('マスタを保存'):
+        named_stores = stores.dropna(subset=['name'])
+        if named_stores['area'].isna().any():
+            st.error('エリアが指定されていない店舗があります')
+            return
+        unknown_areas = set(named_stores['area']) - set(areas['name'].dropna())
+        if unknown_areas:
+            st.error(f"エリアに登録されていないエリアが店舗に指定されています: {'、'.join(sorted(unknown_areas))}")
+            return
+        defaults = {'sort_order': 0, 'active': True}
+        save_master_tables({
+            'employees': employees.fillna(defaults),
+            'areas': areas.fillna(defaults),
+            'stores': stores.fillna({**defaults, 'color': '#000000'}),
+        })
+        clear_registry_caches()
+        st.success('マスタを保存しました')
+        st.experimental_rerun()
+
+# 複数期間の集計ページ（期間ごとの集計テーブルを読むだけで、シフト文字列は解析しない）
+def display_analytics():
+    st.header('分析')
+    current_year = datetime.now().year
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        year = st.selectbox('最後の年', range(current_year - 5, current_year + 10), index=5, key='analytics_year')
+    with col2:
+        month = st.selectbox('最後の月', range(1, 13), index=datetime.now().month - 1, key='analytics_month')
+    with col3:
+        months = st.radio('集計期間', [12, 24, 36], format_func=lambda m: f'{m}か月', horizontal=True, key='analytics_months')
+
+    periods = analytics_periods(year, month, months)
+    rollups, fills = load_rollups(periods)
+    registry = get_registry()
+    employees = list(registry.employees)
+    st.caption(f'{periods[0]} 〜 {periods[-1]} の{months}期間')
+
+    tab_days, tab_stores, tab_fill, tab_mix = st.tabs(['シフト日数', '店舗別ヘルプ日数', '充足率', 'AM/PMの内訳'])
+    with tab_days:
+        days = shift_days_by_period(rollups, periods, employees)
+        days.loc['合計'] = days.sum()
+        st.dataframe(days.style.format("{:.1f}"), use_container_width=True)
+    with tab_stores:
+        store_days = helper_days_by_store(rollups, employees, registry.stores)
+        if store_days.empty:
+            st.write("ヘルプ実績はありません。")
+        else:
+            store_days['合計'] = store_days.sum(axis=1)
+            st.dataframe(store_days.style.format("{:.1f}"), use_container_width=True)
+    with tab_fill:
+        fill_rates = fill_rate_by_store(fills, registry.stores)
+        if fill_rates.empty:
+            st.write("ヘルプ希望はありません。")
+        else:
+            st.dataframe(fill_rates.style.format({'充足率': "{:.0%}"}), use_container_width=True)
+    with tab_mix:
+        mix = shift_mix(rollups, employees)
+        st.dataframe(mix.style.format("{:.0%}", subset=[column for column in mix.columns if column.endswith('(割合)')]),
+                     use_container_width=True)
 
 async def main():
     st.set_page_config(layout="wide")
     st.title('ヘルプ管理アプリ📝')
 
+    with st.sidebar:
+        tenant = st.selectbox('拠点', list(TENANTS.keys()), format_func=TENANTS.get, key='tenant')
+        set_tenant(tenant)
+        # この実行の間はマスタの更新番号をDBに確認しない
+        pin_registry()
+        page = st.radio('ページ', ['ヘルプ管理', '分析', 'マスタ設定'], horizontal=True, key='page')
+    if page == 'マスタ設定':
+        display_master_settings()
+        return
+    if page == '分析':
+        display_analytics()
+        return
+
+    registry = get_registry()
+
     with st.sidebar:
         st.header('設定')
         current_year = datetime.now().year
         selected_year = st.selectbox('年を選択', range(current_year , current_year + 10), key='year_selector')
         selected_month = st.selectbox('月を選択', range(1, 13), key='month_selector')
 
-            # ここで load_shift_data を呼び出し
-        load_shift_data(selected_year, selected_month)
-
-        initialize_shift_data(selected_year, selected_month)
-
-        shifts = get_cached_shifts(selected_year, selected_month)
-        update_session_state_shifts(shifts)
+        st.session_state.data_version = get_data_version(selected_year, selected_month)
+        st.session_state.shift_data = load_month_snapshot(current_tenant(), selected_year, selected_month, st.session_state.data_version)
+        st.session_state.current_year = selected_year
+        st.session_state.current_month = selected_month
 
         st.header('シフト登録/修正')
         
-        employee = st.selectbox('従業員を選択', EMPLOYEES)
-        start_date = datetime(selected_year, selected_month, 16)
-        end_date = start_date + pd.DateOffset(months=1) - pd.Timedelta(days=1)
+        employee = st.selectbox('従業員を選択', registry.employees)
+        start_date, end_date = period_range(selected_year, selected_month)
 
         # デフォルト値を範囲内に設定
         default_date = max(min(datetime.now().date(), end_date.date()), start_date.date())
         
         date = st.date_input('日付を選択', min_value=start_date.date(), max_value=end_date.date(), value=default_date)
         
-        if not isinstance(st.session_state.shift_data.index, pd.DatetimeIndex):
-            st.session_state.shift_data.index = pd.to_datetime(st.session_state.shift_data.index)
-
         date = pd.Timestamp(date)
 
         if date in st.session_state.shift_data.index:
@@ -374,16 +686,19 @@ async def main():
         
         new_shift_str = update_shift_input(current_shift, employee, date)
 
+        # 保存前に、このセルだけの整合性をチェック
+        for issue in validate_shift(date, employee, new_shift_str):
+            st.warning(issue)
+
         if st.button('保存'):
-            await save_shift_async(date, employee, new_shift_str)
-            st.session_state.shift_data.loc[date, employee] = new_shift_str
             st.session_state.editing_shift = False
+            await save_shift_async(date, employee, new_shift_str)
             st.success('保存しました')
             st.experimental_rerun()
 
         st.header('店舗ヘルプ希望登録')
-        area = st.selectbox('エリアを選択', [key for key in AREAS.keys() if key != 'なし'], key='help_area')
-        store = st.selectbox('店舗を選択', AREAS[area], key='help_store')
+        area = st.selectbox('エリアを選択', list(registry.areas.keys()), key='help_area')
+        store = st.selectbox('店舗を選択', registry.areas[area], key='help_store')
         help_default_date = max(min(datetime.now().date(), end_date.date()), start_date.date())
         
         help_date = st.date_input('日付を選択', min_value=start_date.date(), max_value=end_date.date(), value=help_default_date, key='help_date')
@@ -393,38 +708,41 @@ async def main():
             st.success('ヘルプ希望を登録しました')
             st.experimental_rerun()
 
+        display_bulk_import()
+
         st.header('個別PDFのダウンロード')
-        selected_employee = st.selectbox('従業員を選択', EMPLOYEES, key='pdf_employee_selector')
+        selected_employee = st.selectbox('従業員を選択', registry.employees, key='pdf_employee_selector')
         if st.button('PDFを生成'):
             employee_data = st.session_state.shift_data[selected_employee]
-            pdf_buffer = generate_individual_pdf(employee_data, selected_employee, selected_year, selected_month)
-            start_date = pd.Timestamp(selected_year, selected_month, 16)
-            end_date = start_date + pd.DateOffset(months=1) - pd.Timedelta(days=1)
-            file_name = f'{selected_employee}さん_{start_date.strftime("%Y年%m月%d日")}～{end_date.strftime("%Y年%m月%d日")}_シフト.pdf'
-            st.download_button(
-                label=f"{selected_employee}さんのPDFをダウンロード",
-                data=pdf_buffer.getvalue(),
-                file_name=file_name,
-                mime="application/pdf"
-            )
+            data_version = st.session_state.data_version
+            submit_pdf_job('individual', selected_employee, f'{selected_employee}さんのPDF',
+                           individual_pdf_filename(selected_employee, selected_year, selected_month), "application/pdf",
+                           lambda report: cached_individual_pdf(employee_data, selected_employee, selected_year, selected_month, data_version))
 
         st.header('店舗別PDFのダウンロード')
-        selected_area = st.selectbox('エリアを選択', [key for key in AREAS.keys() if key != 'なし'], key='pdf_area_selector')
-        selected_store = st.selectbox('店舗を選択', AREAS[selected_area], key='pdf_store_selector')
+        selected_area = st.selectbox('エリアを選択', list(registry.areas.keys()), key='pdf_area_selector')
+        selected_store = st.selectbox('店舗を選択', registry.areas[selected_area], key='pdf_store_selector')
         if st.button('店舗PDFを生成'):
-            start_date = pd.Timestamp(selected_year, selected_month, 16)
-            end_date = start_date + pd.DateOffset(months=1) - pd.Timedelta(days=1)
-            store_data = st.session_state.shift_data.copy()
-            store_help_requests = get_store_help_requests(start_date, end_date)
-            store_data[selected_store] = store_help_requests[selected_store]
-            pdf_buffer = generate_store_pdf(store_data, selected_store, selected_year, selected_month)
-            file_name = f'{selected_month}月_{selected_store}.pdf'
-            st.download_button(
-                label=f"{selected_store}のPDFをダウンロード",
-                data=pdf_buffer.getvalue(),
-                file_name=file_name,
-                mime="application/pdf"
-            )
+            data_version = st.session_state.data_version
+            submit_pdf_job('store', selected_store, f'{selected_store}のPDF',
+                           store_pdf_filename(selected_store, selected_year, selected_month), "application/pdf",
+                           lambda report: cached_store_pdf(get_shift_segments(start_date, end_date, store=selected_store),
+                                                           selected_store, selected_year, selected_month, data_version))
+
+        st.header('一括PDFダウンロード')
+        merge_pdfs = st.checkbox('1つのPDFにまとめる（しおり付き）', key='merge_pdfs')
+        if st.button('全従業員・全店舗のPDFを生成'):
+            shift_data = st.session_state.shift_data
+            if merge_pdfs:
+                submit_pdf_job('merged', '', '一括PDF', f'{selected_year}年{selected_month}月_一括.pdf', 'application/pdf',
+                               lambda report: export_pdfs_merged(shift_data, get_shift_segments(start_date, end_date),
+                                                                 selected_year, selected_month, progress=report))
+            else:
+                submit_pdf_job('zip', '', 'PDF一式（ZIP）', f'{selected_year}年{selected_month}月_PDF一式.zip', 'application/zip',
+                               lambda report: export_pdfs_zip(shift_data, get_shift_segments(start_date, end_date),
+                                                              selected_year, selected_month, progress=report))
+
+        display_pdf_downloads()
         #if st.button('CSVとしてエクスポート'):
         #    csv_buffer = io.StringIO()
         #    st.session_state.shift_data.to_csv(csv_buffer, index=True)
@@ -435,9 +753,18 @@ async def main():
        #         mime="text/csv"
        #     )
 
+    watch_changes(current_tenant(), selected_year, selected_month)
+    watch_pdf_jobs()
+    display_saved_conflicts()
     display_shift_table(selected_year, selected_month)
     display_store_help_requests(selected_year, selected_month)
+    display_coverage_gaps(selected_year, selected_month)
+    display_assignment_proposal(selected_year, selected_month)
+    display_conflicts(selected_year, selected_month)
+    display_snapshot_diff(selected_year, selected_month)
 
 if __name__ == '__main__':
+    # PyInstallerで固めたアプリでPDFの一括出力のプロセスを起動するため
+    multiprocessing.freeze_support()
     init_db()
     asyncio.run(main())
\ No newline at end of file
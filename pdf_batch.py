@@ -0,0 +1,155 @@
+import io
+import multiprocessing
+import os
+import threading
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import pandas as pd
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.units import mm
+from reportlab.platypus import SimpleDocTemplate, PageBreak, Flowable
+from registry import get_registry, use_registry
+from database import current_tenant, use_tenant
+from shift_calendar import period_range
+from pdf_generator import (generate_individual_pdf, generate_store_pdf, individual_pdf_elements,
+                           store_pdf_elements, register_fonts)
+
+# 一括出力でPDFを生成するプロセスの数
+PDF_PROCESS_WORKERS = min(4, os.cpu_count() or 1)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def individual_pdf_filename(employee, year, month):
+    start_date, end_date = period_range(year, month)
+    return f'{employee}さん_{start_date.strftime("%Y年%m月%d日")}～{end_date.strftime("%Y年%m月%d日")}_シフト.pdf'
+
+
+def store_pdf_filename(store, year, month):
+    return f'{month}月_{store}.pdf'
+
+
+# しおり（アウトライン）を現在のページに追加するだけの描画しない要素
+class Bookmark(Flowable):
+    def __init__(self, key, title):
+        super().__init__()
+        self.key = key
+        self.title = title
+
+    def wrap(self, available_width, available_height):
+        return 0, 0
+
+    def draw(self):
+        self.canv.bookmarkPage(self.key)
+        self.canv.addOutlineEntry(self.title, self.key, level=0)
+
+
+# 1か月分のデータを従業員別・店舗別に1回で振り分ける
+def group_pdf_sources(shift_data, store_segments, employees=None, stores=None):
+    registry = get_registry()
+    employees = registry.employees if employees is None else employees
+    stores = registry.stores if stores is None else stores
+
+    by_employee = {employee: shift_data[employee] if employee in shift_data.columns
+                   else pd.Series('-', index=shift_data.index) for employee in employees}
+    grouped = dict(tuple(store_segments.groupby('store', sort=False)))
+    empty_segments = store_segments.iloc[0:0]
+    by_store = {store: grouped.get(store, empty_segments) for store in stores}
+    return by_employee, by_store
+
+
+# ワーカープロセスで1つのPDFを生成する（フォントはプロセスごとに1度だけ読み込まれる）
+# ワーカーには呼び出し元の拠点が引き継がれないため、ジョブに拠点を持たせる（マスタはジョブごとに1度だけ確認する）
+def _render_job(job):
+    tenant, kind, key, source, year, month = job
+    with use_tenant(tenant), use_registry(get_registry()):
+        if kind == 'individual':
+            return individual_pdf_filename(key, year, month), generate_individual_pdf(source, key, year, month).getvalue()
+        return store_pdf_filename(key, year, month), generate_store_pdf(source, key, year, month).getvalue()
+
+
+# 一括出力用のプロセスプールを1度だけ作って使い回す（フォントは各プロセスの起動時に1度だけ読み込む）
+# サーバーはスレッドとSQLiteの接続を持っているため、forkで複製せずspawnで起動する
+def _process_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ProcessPoolExecutor(max_workers=PDF_PROCESS_WORKERS, initializer=register_fonts,
+                                            mp_context=multiprocessing.get_context('spawn'))
+    return _pool
+
+
+# ワーカーが異常終了したプールは使えないため、次の一括出力で作り直す
+def _discard_process_pool(pool):
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False)
+
+
+def _build_jobs(by_employee, by_store, year, month):
+    tenant = current_tenant()
+    return ([(tenant, 'individual', employee, data, year, month) for employee, data in by_employee.items()] +
+            [(tenant, 'store', store, segments, year, month) for store, segments in by_store.items()])
+
+
+# 全従業員・全店舗のPDFをZIPにまとめる（parallel=Falseまたは1CPUならプロセスを使わずに順番に生成）
+# progress(済んだ数, 全体の数) を渡すと1ファイルできるごとに呼ぶ
+def export_pdfs_zip(shift_data, store_segments, year, month, parallel=True, progress=None):
+    by_employee, by_store = group_pdf_sources(shift_data, store_segments)
+    jobs = _build_jobs(by_employee, by_store, year, month)
+
+    results = []
+    if parallel and PDF_PROCESS_WORKERS > 1:
+        pool = _process_pool()
+        try:
+            for result in pool.map(_render_job, jobs):
+                results.append(result)
+                if progress:
+                    progress(len(results), len(jobs))
+        except BrokenProcessPool:
+            _discard_process_pool(pool)
+            raise
+    else:
+        for job in jobs:
+            results.append(_render_job(job))
+            if progress:
+                progress(len(results), len(jobs))
+
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for file_name, pdf_bytes in results:
+            archive.writestr(file_name, pdf_bytes)
+    buffer.seek(0)
+    return buffer
+
+
+# 全従業員・全店舗を1つのPDFにまとめ、従業員・店舗ごとにしおりを付ける
+# progress(済んだ数, 全体の数) を渡すとReportLabが要素を1つ配置するごとに呼ぶ
+def export_pdfs_merged(shift_data, store_segments, year, month, progress=None):
+    by_employee, by_store = group_pdf_sources(shift_data, store_segments)
+
+    elements = []
+    for i, (employee, data) in enumerate(by_employee.items()):
+        elements += [Bookmark(f'employee-{i}', f'{employee}さん')] + individual_pdf_elements(data, employee, year, month)
+        elements.append(PageBreak())
+    for i, (store, segments) in enumerate(by_store.items()):
+        elements += [Bookmark(f'store-{i}', store)] + store_pdf_elements(segments, store, year, month)
+        elements.append(PageBreak())
+    if elements:
+        elements.pop()
+
+    buffer = io.BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=A4, rightMargin=10*mm, leftMargin=10*mm, topMargin=10*mm, bottomMargin=10*mm,
+                            title=f'{year}年{month}月 ヘルプ一括出力')
+    if progress:
+        total = len(elements)
+        doc.setProgressCallBack(lambda kind, value: progress(value, total) if kind == 'PROGRESS' else None)
+    register_fonts()
+    doc.build(elements)
+    buffer.seek(0)
+    return buffer
@@ -0,0 +1,108 @@
+import glob
+import hashlib
+import io
+import os
+import threading
+import pandas as pd
+from shift_calendar import period_key
+from database import current_tenant
+from registry import get_registry
+from pdf_generator import generate_help_table_pdf, generate_individual_pdf, generate_store_pdf
+
+# ローカル環境とStreamlit Cloud環境を区別（database.DB_NAMEと同じ置き場所）
+if os.environ.get('STREAMLIT_CLOUD'):
+    PDF_CACHE_DIR = '/app/data/pdf_cache'
+else:
+    PDF_CACHE_DIR = '.pdf_cache'
+
+MAX_CACHE_BYTES = 200 * 1024 * 1024
+
+_evict_lock = threading.Lock()
+
+
+# 入力データ・種類・名前・マスタの更新番号（従業員の並びや店舗の色が変わるため）から内容ハッシュを作る
+def content_digest(kind, name, data):
+    digest = hashlib.sha256(f'{kind}\0{name}\0{get_registry().version}\0'.encode())
+    if isinstance(data, pd.DataFrame):
+        digest.update('\0'.join(map(str, data.columns)).encode())
+    digest.update(pd.util.hash_pandas_object(data, index=True).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+# 拠点ごとのキャッシュディレクトリ（更新番号は拠点ごとに独立しているため）
+def _cache_dir():
+    return os.path.join(PDF_CACHE_DIR, current_tenant())
+
+
+def _cache_path(year, month, data_version, digest):
+    return os.path.join(_cache_dir(), f'{period_key(year, month)}_v{data_version}_{digest}.pdf')
+
+
+# 期間の古い更新番号のPDFを削除する（保存されると更新番号が増えるため）
+def _purge_stale_versions(year, month, data_version):
+    current_prefix = f'{period_key(year, month)}_v{data_version}_'
+    for path in glob.glob(os.path.join(_cache_dir(), f'{period_key(year, month)}_v*.pdf')):
+        if not os.path.basename(path).startswith(current_prefix):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+# 合計サイズが上限を超えたら最終アクセス（mtime）が古いものから削除する
+def _evict(max_bytes=MAX_CACHE_BYTES):
+    with _evict_lock:
+        entries = []
+        for path in glob.glob(os.path.join(PDF_CACHE_DIR, '*', '*.pdf')):
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+
+# キャッシュにあればそれを返し、なければ render() で生成して保存する
+def get_or_render(kind, name, data, year, month, data_version, render):
+    path = _cache_path(year, month, data_version, content_digest(kind, name, data))
+    try:
+        with open(path, 'rb') as f:
+            pdf_bytes = f.read()
+        os.utime(path)
+        return io.BytesIO(pdf_bytes)
+    except FileNotFoundError:
+        pass
+
+    buffer = render()
+    os.makedirs(_cache_dir(), exist_ok=True)
+    _purge_stale_versions(year, month, data_version)
+    tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(buffer.getvalue())
+    os.replace(tmp_path, path)
+    _evict()
+    buffer.seek(0)
+    return buffer
+
+
+def cached_help_table_pdf(data, year, month, data_version):
+    return get_or_render('help_table', '', data, year, month, data_version,
+                         lambda: generate_help_table_pdf(data, year, month))
+
+
+def cached_individual_pdf(data, employee, year, month, data_version):
+    return get_or_render('individual', employee, data, year, month, data_version,
+                         lambda: generate_individual_pdf(data, employee, year, month))
+
+
+def cached_store_pdf(store_segments, store_name, year, month, data_version):
+    return get_or_render('store', store_name, store_segments, year, month, data_version,
+                         lambda: generate_store_pdf(store_segments, store_name, year, month))
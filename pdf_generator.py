@@ -1,4 +1,6 @@
 import io
+import threading
+from functools import lru_cache
 import pandas as pd
 from reportlab.lib import colors
 from reportlab.lib.colors import HexColor
@@ -9,13 +11,13 @@ from reportlab.lib.units import mm
 from reportlab.pdfbase import pdfmetrics
 from reportlab.pdfbase.ttfonts import TTFont
 from reportlab.lib.colors import Color
-from constants import STORE_COLORS, WEEKDAY_JA, SATURDAY_BG_COLOR, SUNDAY_BG_COLOR, EMPLOYEES, HOLIDAY_BG_COLOR
+from constants import SUNDAY_BG_COLOR, HOLIDAY_BG_COLOR
+from registry import get_registry
 from io import BytesIO
-from utils import parse_shift  # parse_shift関数をutils.pyからインポート
-from datetime import datetime
+import shift_model
 from reportlab.lib.enums import TA_CENTER
 from constants import HOLIDAY_BG_COLOR, KANOYA_BG_COLOR, KAGOKITA_BG_COLOR, DARK_GREY_TEXT_COLOR, SPECIAL_SHIFT_TYPES,RECRUIT_BG_COLOR
-import jpholiday
+from shift_calendar import period_range, period_calendar, calendar_for_dates
 
 # グローバルスコープでスタイルを定義
 styles = getSampleStyleSheet()
@@ -54,36 +56,43 @@ special_shift_style = ParagraphStyle('SpecialShift',
                                      parent=bold_style2, 
                                      textColor=colors.HexColor("#595959"))
 
-def hex_to_rgb(hex_color):
-    hex_color = hex_color.lstrip('#')
-    return tuple(int(hex_color[i:i+2], 16) / 255.0 for i in (0, 2, 4))
-
-def format_shift_for_individual_pdf(shift_type, times, stores):
-    if shift_type in ['-', 'AM', 'PM', '1日']:
-        return [Paragraph(f'<b>{shift_type}</b>', bold_style2)]
-    elif shift_type in SPECIAL_SHIFT_TYPES:
-        # 各特別シフトタイプに対応する背景色を設定
-        bg_color = (HOLIDAY_BG_COLOR if shift_type == '休み' 
-                   else KANOYA_BG_COLOR if shift_type == '鹿屋' 
-                   else KAGOKITA_BG_COLOR if shift_type == 'かご北'
-                   else RECRUIT_BG_COLOR if shift_type == 'リクルート'
-                   else None)
-        special_style = ParagraphStyle('SpecialShift', parent=bold_style2, textColor=colors.HexColor(DARK_GREY_TEXT_COLOR), backColor=colors.HexColor(bg_color))
-        return [Paragraph(f'<b>{shift_type}</b>', special_style)]
-    return [Paragraph(f'<font color="{STORE_COLORS.get(store, "#000000")}"><b>{time}@{store}</b></font>', bold_style2) 
-            for time, store in zip(times, stores) if time and store]
-
-def generate_help_table_pdf(data, year, month):
-    buffer = io.BytesIO()
-    custom_page_size = (landscape(A4)[0] * 1.05, landscape(A4)[1] * 1.1)
-    doc = SimpleDocTemplate(buffer, pagesize=custom_page_size, rightMargin=5*mm, leftMargin=5*mm, topMargin=10*mm, bottomMargin=10*mm)
-    elements = []
-
-    pdfmetrics.registerFont(TTFont('NotoSansJP', 'NotoSansJP-VariableFont_wght.ttf'))
-    pdfmetrics.registerFont(TTFont('NotoSansJP-Bold', 'NotoSansJP-Bold.ttf'))
-
-    styles = getSampleStyleSheet()
-
+FONT_FILES = {
+    'NotoSansJP': 'NotoSansJP-VariableFont_wght.ttf',
+    'NotoSansJP-Bold': 'NotoSansJP-Bold.ttf',
+}
+
+# 特別シフトの背景色
+SPECIAL_SHIFT_BG_COLORS = {
+    '休み': HOLIDAY_BG_COLOR,
+    '鹿屋': KANOYA_BG_COLOR,
+    'かご北': KAGOKITA_BG_COLOR,
+    'リクルート': RECRUIT_BG_COLOR,
+}
+
+_font_lock = threading.Lock()
+
+# フォントはプロセス内で1度だけ読み込む（CJKのTTFは大きく、解析に時間がかかるため）
+def register_fonts():
+    if all(name in pdfmetrics.getRegisteredFontNames() for name in FONT_FILES):
+        return
+    with _font_lock:
+        registered = pdfmetrics.getRegisteredFontNames()
+        for name, path in FONT_FILES.items():
+            if name not in registered:
+                pdfmetrics.registerFont(TTFont(name, path))
+
+# 文字色・背景色を変えたスタイルを (元のスタイル, 文字色, 背景色) ごとに使い回す
+@lru_cache(maxsize=128)
+def derived_style(base_name, text_color, back_color=None):
+    parent = {'Bold': bold_style, 'Bold2': bold_style2}[base_name]
+    return ParagraphStyle(f'{base_name}-{text_color}-{back_color}',
+                          parent=parent,
+                          textColor=colors.HexColor(text_color),
+                          backColor=colors.HexColor(back_color) if back_color else None)
+
+# ヘルプ表PDF用のスタイル
+@lru_cache(maxsize=None)
+def _help_table_styles():
     title_style = ParagraphStyle('Title', 
                                  parent=styles['Heading1'], 
                                  fontName='NotoSansJP-Bold', 
@@ -107,9 +116,62 @@ def generate_help_table_pdf(data, year, month):
                                   parent=bold_style, 
                                   fontSize=8,  # ヘッダーのフォントサイズも少し小さくする
                                   textColor=colors.white)
+    return title_style, normal_style, bold_style, header_style
+
+# 店舗別PDF用のスタイル
+@lru_cache(maxsize=None)
+def _store_styles():
+    title_style = ParagraphStyle('Title', 
+                                 parent=styles['Heading1'], 
+                                 fontName='NotoSansJP-Bold', 
+                                 fontSize=16, 
+                                 textColor=colors.HexColor("#373737"))
+
+    normal_style = ParagraphStyle('Normal', 
+                                  parent=styles['Normal'], 
+                                  fontName='NotoSansJP', 
+                                  fontSize=10, 
+                                  alignment=TA_CENTER, 
+                                  textColor=colors.HexColor("#373737"))
+
+    bold_style = ParagraphStyle('Bold', 
+                                parent=normal_style, 
+                                fontSize=9,
+                                fontName='NotoSansJP-Bold')
+
+    header_style = ParagraphStyle('Header', 
+                                  parent=bold_style, 
+                                  fontSize=10,
+                                  textColor=colors.white)
+    return title_style, normal_style, bold_style, header_style
+
+def hex_to_rgb(hex_color):
+    hex_color = hex_color.lstrip('#')
+    return tuple(int(hex_color[i:i+2], 16) / 255.0 for i in (0, 2, 4))
+
+def format_shift_for_individual_pdf(shift_type, times, stores, store_colors=None):
+    store_colors = get_registry().store_colors if store_colors is None else store_colors
+    if shift_type in ['-', 'AM', 'PM', '1日']:
+        return [Paragraph(f'<b>{shift_type}</b>', bold_style2)]
+    elif shift_type in SPECIAL_SHIFT_TYPES:
+        # 各特別シフトタイプに対応する背景色を設定
+        special_style = derived_style('Bold2', DARK_GREY_TEXT_COLOR, SPECIAL_SHIFT_BG_COLORS.get(shift_type))
+        return [Paragraph(f'<b>{shift_type}</b>', special_style)]
+    return [Paragraph(f'<font color="{store_colors.get(store, "#000000")}"><b>{time}@{store}</b></font>', bold_style2) 
+            for time, store in zip(times, stores) if time and store]
 
-    start_date = pd.Timestamp(year, month, 16)
-    end_date = start_date + pd.DateOffset(months=1) - pd.Timedelta(days=1)
+def generate_help_table_pdf(data, year, month):
+    buffer = io.BytesIO()
+    custom_page_size = (landscape(A4)[0] * 1.05, landscape(A4)[1] * 1.1)
+    doc = SimpleDocTemplate(buffer, pagesize=custom_page_size, rightMargin=5*mm, leftMargin=5*mm, topMargin=10*mm, bottomMargin=10*mm)
+    elements = []
+
+    register_fonts()
+    title_style, normal_style, bold_style, header_style = _help_table_styles()
+    registry = get_registry()
+    employees = registry.employees
+
+    start_date, end_date = period_range(year, month)
     next_month_start = pd.Timestamp(year, month, 1) + pd.DateOffset(months=1)
 
     date_ranges = [
@@ -126,21 +188,21 @@ def generate_help_table_pdf(data, year, month):
         elements.append(Spacer(1, 5*mm))
 
         filtered_data = data[(data.index >= range_start) & (data.index <= range_end)]
+        calendar = calendar_for_dates(filtered_data.index)
 
         table_data = [
             [
                 Paragraph(f'<font color="white"><b>日付</b></font>', header_style),
                 Paragraph(f'<font color="white"><b>曜日</b></font>', header_style)
-            ] + [Paragraph(f'<font color="white"><b>{emp}</b></font>', header_style) for emp in EMPLOYEES]
+            ] + [Paragraph(f'<font color="white"><b>{emp}</b></font>', header_style) for emp in employees]
         ]
 
-        for date, row in filtered_data.iterrows():
-            weekday = WEEKDAY_JA.get(date.strftime('%a'), date.strftime('%a'))
+        for (date, row), weekday in zip(filtered_data.iterrows(), calendar['曜日']):
             date_str = date.strftime('%Y-%m-%d')
-            employee_shifts = [format_shift_for_pdf(row[emp]) for emp in EMPLOYEES]
+            employee_shifts = [format_shift_for_pdf(row[emp], registry.store_colors) for emp in employees]
             table_data.append([Paragraph(f'<b>{date_str}</b>', bold_style), Paragraph(f'<b>{weekday}</b>', bold_style)] + employee_shifts)
 
-        col_widths = [50, 40] + [78] * len(EMPLOYEES)  # 各列の幅を調整
+        col_widths = [50, 40] + [78] * len(employees)  # 各列の幅を調整
         table = Table(table_data, colWidths=col_widths, repeatRows=1)
         
         table_style = TableStyle([
@@ -159,11 +221,9 @@ def generate_help_table_pdf(data, year, month):
             ('TEXTCOLOR', (0, 1), (-1, -1), colors.HexColor("#373737")),
         ])
 
-        for i, (date, row) in enumerate(filtered_data.iterrows(), start=1):
-            if date.strftime('%a') == 'Sun' or jpholiday.is_holiday(date):
-                table_style.add('BACKGROUND', (0, i), (-1, i), colors.HexColor(HOLIDAY_BG_COLOR))
-            elif date.strftime('%a') == 'Sat':
-                table_style.add('BACKGROUND', (0, i), (-1, i), colors.HexColor(SATURDAY_BG_COLOR))
+        for i, background in enumerate(calendar['背景色'], start=1):
+            if background:
+                table_style.add('BACKGROUND', (0, i), (-1, i), colors.HexColor(background))
 
         table.setStyle(table_style)
         elements.append(table)
@@ -173,76 +233,63 @@ def generate_help_table_pdf(data, year, month):
     return buffer
 
 
-def format_shift_for_pdf(shift):
+def format_shift_for_pdf(shift, store_colors=None):
     if pd.isna(shift) or shift == '-':
         return Paragraph('-', normal_style)
     
-    if shift == '休み':
-        return Paragraph('<b>休み</b>', ParagraphStyle('Holiday', 
-                                                      parent=bold_style, 
-                                                      textColor=colors.HexColor("#373737"),
-                                                      backColor=colors.HexColor(HOLIDAY_BG_COLOR)))
-    if shift == '鹿屋':
-        return Paragraph('<b>鹿屋</b>', ParagraphStyle('Kanoya', 
-                                                      parent=bold_style, 
-                                                      textColor=colors.HexColor("#373737"),
-                                                      backColor=colors.HexColor(KANOYA_BG_COLOR)))
-    if shift == 'かご北':
-        return Paragraph('<b>かご北</b>', ParagraphStyle('Kagokita', 
-                                                        parent=bold_style, 
-                                                        textColor=colors.HexColor("#373737"),
-                                                        backColor=colors.HexColor(KAGOKITA_BG_COLOR)))
-    if shift == 'リクルート':
-        return Paragraph('<b>リクルート</b>', ParagraphStyle('Recruit', 
-                                                        parent=bold_style, 
-                                                        textColor=colors.HexColor("#373737"),
-                                                        backColor=colors.HexColor(RECRUIT_BG_COLOR)))
-    shift_parts = shift.split(',')
-    shift_type = shift_parts[0]
+    if shift in SPECIAL_SHIFT_BG_COLORS:
+        return Paragraph(f'<b>{shift}</b>', derived_style('Bold', "#373737", SPECIAL_SHIFT_BG_COLORS[shift]))
+    parsed = shift_model.parse(shift)
     formatted_parts = []
+    store_colors = get_registry().store_colors if store_colors is None else store_colors
 
-    shift_type_color = "#595959" if shift_type in ['AM可', 'PM可', '1日可'] else "#373737"
-    formatted_parts.append(Paragraph(f'<font color="{shift_type_color}"><b>{shift_type}</b></font>', bold_style))
+    shift_type_color = "#595959" if parsed.is_availability else "#373737"
+    formatted_parts.append(Paragraph(f'<font color="{shift_type_color}"><b>{parsed.shift_type}</b></font>', bold_style))
     
-    for part in shift_parts[1:]:
-        if '@' in part:
-            time, store = part.split('@')
-            color = STORE_COLORS.get(store, "#373737")
-            formatted_parts.append(Paragraph(f'<font color="{color}"><b>{time}@{store}</b></font>', bold_style))
+    for segment in parsed.segments:
+        if segment.store:
+            color = store_colors.get(segment.store, "#373737")
+            formatted_parts.append(Paragraph(f'<font color="{color}"><b>{segment.time}@{segment.store}</b></font>', bold_style))
         else:
-            formatted_parts.append(Paragraph(f'<b>{part}</b>', bold_style))
+            formatted_parts.append(Paragraph(f'<b>{segment.time}</b>', bold_style))
     
     return formatted_parts
 
 def generate_individual_pdf(data, employee, year, month):
     buffer = BytesIO()
     doc = SimpleDocTemplate(buffer, pagesize=A4, rightMargin=10*mm, leftMargin=10*mm, topMargin=10*mm, bottomMargin=10*mm)
-    elements = []
 
-    pdfmetrics.registerFont(TTFont('NotoSansJP', 'NotoSansJP-VariableFont_wght.ttf'))
-    pdfmetrics.registerFont(TTFont('NotoSansJP-Bold', 'NotoSansJP-Bold.ttf'))
+    register_fonts()
+    doc.build(individual_pdf_elements(data, employee, year, month))
+    buffer.seek(0)
+    return buffer
+
+# 個別PDFの中身（一括出力で1つのPDFにまとめる場合にも使う）
+def individual_pdf_elements(data, employee, year, month):
+    elements = []
 
     title = Paragraph(f"{employee}さん {year}年{month}月 シフト表", title_style)
     elements.append(title)
     elements.append(Spacer(1, 10))
 
-    start_date = pd.Timestamp(year, month, 16)
-    end_date = start_date + pd.DateOffset(months=1) - pd.Timedelta(days=1)
+    start_date, end_date = period_range(year, month)
     filtered_data = data[(data.index >= start_date) & (data.index <= end_date)]
 
-    max_shifts = max(len(str(shift).split(',')) - 1 for shift in filtered_data if not pd.isna(shift))
+    parsed_shifts = [shift_model.parse(shift) if pd.notna(shift) else shift_model.EMPTY_SHIFT for shift in filtered_data]
+    max_shifts = max([len(parsed.segments) for parsed in parsed_shifts] + [1])
     
     col_widths = [20*mm, 15*mm] + [30*mm] * max_shifts
     
     table_data = [['日付', '曜日'] + [f'シフト{i+1}' for i in range(max_shifts)]]
     
-    for date, shift in filtered_data.items():
-        weekday = WEEKDAY_JA[date.strftime('%a')]
-        shift_parts = str(shift).split(',') if pd.notna(shift) else ['-']
-        shift_type = shift_parts[0]
-        times_stores = [part.strip().split('@') for part in shift_parts[1:] if '@' in part]
-        times, stores = zip(*times_stores) if times_stores else ([], [])
-        formatted_shifts = format_shift_for_individual_pdf(shift_type, times, stores)
+    calendar = calendar_for_dates(filtered_data.index)
+    store_colors = get_registry().store_colors
+
+    for date, weekday, parsed in zip(filtered_data.index, calendar['曜日'], parsed_shifts):
+        store_segments = parsed.store_segments
+        times = [segment.time for segment in store_segments]
+        stores = [segment.store for segment in store_segments]
+        formatted_shifts = format_shift_for_individual_pdf(parsed.shift_type, times, stores, store_colors)
         row = [date.strftime('%m/%d'), weekday] + formatted_shifts + [''] * (max_shifts - len(formatted_shifts))
         table_data.append(row)
 
@@ -261,12 +308,9 @@ def generate_individual_pdf(data, employee, year, month):
         ('GRID', (0, 0), (-1, -1), 0.5, colors.black)
     ])
 
-    for i, row in enumerate(table_data[1:], start=1):
-        date = pd.to_datetime(filtered_data.index[i-1])
-        if '日' in row[1] or jpholiday.is_holiday(date):
-            style.add('BACKGROUND', (0, i), (-1, i), colors.HexColor(HOLIDAY_BG_COLOR))
-        elif '土' in row[1]:
-            style.add('BACKGROUND', (0, i), (-1, i), colors.HexColor(SATURDAY_BG_COLOR))
+    for i, (row, background) in enumerate(zip(table_data[1:], calendar['背景色']), start=1):
+        if background:
+            style.add('BACKGROUND', (0, i), (-1, i), colors.HexColor(background))
 
         for j, cell in enumerate(row[2:], start=2):
             if isinstance(cell, list) and len(cell) > 0 and isinstance(cell[0], Paragraph):
@@ -281,55 +325,21 @@ def generate_individual_pdf(data, employee, year, month):
 
     t.setStyle(style)
     elements.append(t)
-    doc.build(elements)
-    buffer.seek(0)
-    return buffer
+    return elements
 
-def time_to_minutes(time_str):
-    if '-' in time_str:
-        start_time = time_str.split('-')[0]
-    else:
-        start_time = time_str
-    if '半' in start_time:
-        start_time = start_time.replace('半', ':30')
-    else:
-        start_time += ':00'
-    time_obj = datetime.strptime(start_time, '%H:%M')
-    return time_obj.hour * 60 + time_obj.minute
-
-def generate_store_pdf(store_data, store_name, year, month):
+def generate_store_pdf(store_segments, store_name, year, month):
     buffer = io.BytesIO()
     doc = SimpleDocTemplate(buffer, pagesize=A4, rightMargin=20, leftMargin=20, topMargin=20, bottomMargin=18)
-    elements = []
-
-    pdfmetrics.registerFont(TTFont('NotoSansJP', 'NotoSansJP-VariableFont_wght.ttf'))
-    pdfmetrics.registerFont(TTFont('NotoSansJP-Bold', 'NotoSansJP-Bold.ttf'))
-
-    # スタイルの定義
-    styles = getSampleStyleSheet()
-    
-    title_style = ParagraphStyle('Title', 
-                                 parent=styles['Heading1'], 
-                                 fontName='NotoSansJP-Bold', 
-                                 fontSize=16, 
-                                 textColor=colors.HexColor("#373737"))
 
-    normal_style = ParagraphStyle('Normal', 
-                                  parent=styles['Normal'], 
-                                  fontName='NotoSansJP', 
-                                  fontSize=10, 
-                                  alignment=TA_CENTER, 
-                                  textColor=colors.HexColor("#373737"))
-
-    bold_style = ParagraphStyle('Bold', 
-                                parent=normal_style, 
-                                fontSize=9,
-                                fontName='NotoSansJP-Bold')
+    register_fonts()
+    doc.build(store_pdf_elements(store_segments, store_name, year, month))
+    buffer.seek(0)
+    return buffer
 
-    header_style = ParagraphStyle('Header', 
-                                  parent=bold_style, 
-                                  fontSize=10,
-                                  textColor=colors.white)
+# 店舗別PDFの中身（一括出力で1つのPDFにまとめる場合にも使う）
+def store_pdf_elements(store_segments, store_name, year, month):
+    elements = []
+    title_style, normal_style, bold_style, header_style = _store_styles()
 
     # タイトル
     title = Paragraph(f"{year}年{month}月 {store_name}", title_style)
@@ -346,20 +356,21 @@ def generate_store_pdf(store_data, store_name, year, month):
     data = [[Paragraph(f'<b>{h}</b>', header_style) for h in header]]
     row_colors = [('BACKGROUND', (0, 0), (-1, 0), colors.grey)]  # ヘッダー行の背景色
 
-    for i, (date, row) in enumerate(store_data.iterrows(), start=1):
-        day_of_week = WEEKDAY_JA.get(date.strftime('%a'), date.strftime('%a'))
+    # 日付ごとの (開始分, 時間, 従業員) 一覧
+    shifts_by_date = {}
+    for segment in store_segments.itertuples(index=False):
+        start_min = segment.start_min if pd.notna(segment.start_min) else 24 * 60
+        shifts_by_date.setdefault(segment.date, []).append((start_min, segment.time, segment.employee))
+
+    calendar = period_calendar(year, month)
+    employee_index = get_registry().employee_index
+
+    for i, (date, day_of_week, background) in enumerate(zip(calendar.index, calendar['曜日'], calendar['背景色']), start=1):
         date_str = f"{date.strftime('%m月%d日')} {day_of_week}"
-        shifts = []
-        for emp in EMPLOYEES:
-            shift = row.get(emp, '-')
-            if shift != '-':
-                shift_type, shift_times, shift_stores = parse_shift(shift)
-                for time, store in zip(shift_times, shift_stores):
-                    if store == store_name:
-                        shifts.append((time_to_minutes(time), time, emp))
+        shifts = shifts_by_date.get(date, [])
         
-        # 時間でソート
-        shifts.sort(key=lambda x: x[0])
+        # 時間でソート（同時刻は従業員順）
+        shifts.sort(key=lambda x: (x[0], employee_index.get(x[2], len(employee_index))))
         
         if shifts:
             time_str = '<br/>'.join([shift[1] for shift in shifts])
@@ -372,11 +383,9 @@ def generate_store_pdf(store_data, store_name, year, month):
         
         data.append([Paragraph(date_str, normal_style), time_paragraph, helper_paragraph, ''])
 
-        # 土曜日と日曜日の背景色を設定
-        if day_of_week == '日' or jpholiday.is_holiday(date):
-            row_colors.append(('BACKGROUND', (0, i), (-1, i), colors.HexColor(HOLIDAY_BG_COLOR)))
-        elif day_of_week == '土':
-            row_colors.append(('BACKGROUND', (0, i), (-1, i), colors.HexColor(SATURDAY_BG_COLOR)))
+        # 土曜日と日曜日・祝日の背景色を設定
+        if background:
+            row_colors.append(('BACKGROUND', (0, i), (-1, i), colors.HexColor(background)))
 
     # テーブルの作成
     table = Table(data, colWidths=[80, 80, 80, 80])
@@ -392,12 +401,7 @@ def generate_store_pdf(store_data, store_name, year, month):
     ] + row_colors))
 
     elements.append(table)
-
-    # PDFの生成
-    doc.build(elements)
-
-    buffer.seek(0)
-    return buffer
+    return elements
 #streamlit run main.py
 # メイン実行部分（必要に応じて）
 if __name__ == "__main__":
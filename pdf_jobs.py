@@ -0,0 +1,123 @@
+import itertools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from database import current_tenant, use_tenant
+from registry import get_registry, use_registry
+
+# 同時に生成するジョブの数（一括出力はさらにプロセスを使うため少なめにする）
+MAX_PDF_WORKERS = 2
+# 完了したジョブを残しておく数（超えたら完了が古いものから捨てる）
+MAX_FINISHED_JOBS = 32
+
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+JOB_STATUS_LABELS = {JOB_QUEUED: '待機中', JOB_RUNNING: '生成中', JOB_DONE: '完了', JOB_FAILED: '失敗'}
+
+
+# PDF生成ジョブ1件の状態（ワーカーだけが更新し、画面からは読むだけ）
+class PdfJob:
+    __slots__ = ('job_id', 'key', 'label', 'file_name', 'mime', 'status', 'done_steps', 'total_steps',
+                 'data', 'error', 'finished_at')
+
+    def __init__(self, job_id, key, label, file_name, mime):
+        self.job_id = job_id
+        self.key = key
+        self.label = label
+        self.file_name = file_name
+        self.mime = mime
+        self.status = JOB_QUEUED
+        self.done_steps = 0
+        self.total_steps = 1
+        self.data = None
+        self.error = None
+        self.finished_at = None
+
+    @property
+    def finished(self):
+        return self.status in (JOB_DONE, JOB_FAILED)
+
+    @property
+    def progress(self):
+        return min(self.done_steps / self.total_steps, 1.0) if self.total_steps else 0.0
+
+    # 生成処理から (済んだ数, 全体の数) を受け取る
+    def report(self, done_steps, total_steps):
+        self.done_steps = done_steps
+        self.total_steps = total_steps
+
+    def __repr__(self):
+        return f'PdfJob({self.job_id!r}, {self.label!r}, {self.status})'
+
+
+# PDFをスクリプトのスレッドの外で生成するジョブキュー（全セッションで1つを共有する）
+# 同じ内容のジョブ（拠点＋key が同じ）は待機中・生成中・完了済みのものを使い回す
+class PdfJobQueue:
+    def __init__(self, max_workers=MAX_PDF_WORKERS, max_finished=MAX_FINISHED_JOBS):
+        self.max_finished = max_finished
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='pdf-job')
+        self._jobs = {}
+        self._job_ids_by_key = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    # render(report) はPDF（BytesIO）を返す関数。登録時の拠点とマスタでワーカーから呼ばれる
+    # keyには生成結果を決めるもの（種類・名前・期間・更新番号など）をすべて入れること
+    def submit(self, key, label, file_name, mime, render):
+        tenant = current_tenant()
+        registry = get_registry()
+        key = (tenant,) + tuple(key)
+        with self._lock:
+            job = self._jobs.get(self._job_ids_by_key.get(key))
+            if job is not None and job.status != JOB_FAILED:
+                return job
+            job = PdfJob(f'pdf-{next(self._ids)}', key, label, file_name, mime)
+            self._jobs[job.job_id] = job
+            self._job_ids_by_key[key] = job.job_id
+        self._executor.submit(self._run, job, tenant, registry, render)
+        return job
+
+    def _run(self, job, tenant, registry, render):
+        job.status = JOB_RUNNING
+        try:
+            with use_tenant(tenant), use_registry(registry):
+                buffer = render(job.report)
+            job.data = buffer.getvalue()
+            job.done_steps = job.total_steps
+            job.status = JOB_DONE
+        except Exception as e:
+            job.error = str(e) or type(e).__name__
+            job.status = JOB_FAILED
+        job.finished_at = time.time()
+        self._prune()
+
+    # 捨てられたジョブはNone
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+    def _prune(self):
+        with self._lock:
+            finished = sorted((job for job in self._jobs.values() if job.finished), key=lambda job: job.finished_at)
+            for job in finished[:max(len(finished) - self.max_finished, 0)]:
+                del self._jobs[job.job_id]
+                if self._job_ids_by_key.get(job.key) == job.job_id:
+                    del self._job_ids_by_key[job.key]
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+# プロセスで1つのジョブキュー（Streamlitのキャッシュに置くと、キャッシュの全消去で生成中のジョブが失われる）
+def get_pdf_job_queue():
+    global _queue
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None:
+                _queue = PdfJobQueue()
+    return _queue
@@ -0,0 +1,79 @@
+import contextvars
+from contextlib import contextmanager
+from functools import lru_cache
+from types import MappingProxyType
+from database import get_master_tables, get_registry_version, current_tenant
+
+DEFAULT_STORE_COLOR = '#000000'
+
+# 画面の1回の実行・PDFの生成ジョブの間だけ使い回すマスタ（Noneなら呼ぶたびに更新番号を確認する）
+_pinned_registry = contextvars.ContextVar('registry', default=None)
+
+
+# 従業員・店舗・エリアのマスタ（キャッシュで共有されるため生成後は変更しないこと）
+class Registry:
+    __slots__ = ('tenant', 'version', 'employees', 'areas', 'stores', 'store_areas', 'store_colors',
+                 'employee_index', 'store_index')
+
+    def __init__(self, tenant, version, employees, areas, stores):
+        active_areas = areas[areas['active'].astype(bool)]['name'].tolist()
+        active_stores = stores[stores['active'].astype(bool)]
+
+        self.tenant = tenant
+        self.version = version
+        # 有効なものだけを並び順どおりに持つ（画面の選択肢・表の列）
+        self.employees = tuple(employees[employees['active'].astype(bool)]['name'])
+        self.areas = MappingProxyType({area: tuple(active_stores[active_stores['area'] == area]['name'])
+                                       for area in active_areas})
+        self.stores = tuple(store for area_stores in self.areas.values() for store in area_stores)
+        # 無効にした店舗も過去のシフトの表示に使うため、エリアと色は全店舗分持つ
+        self.store_areas = MappingProxyType(dict(zip(stores['name'], stores['area'])))
+        self.store_colors = MappingProxyType(dict(zip(stores['name'], stores['color'])))
+        self.employee_index = MappingProxyType({employee: i for i, employee in enumerate(self.employees)})
+        self.store_index = MappingProxyType({store: i for i, store in enumerate(self.stores)})
+
+    # シフト登録で使うエリアの選択肢（店舗なしの「なし」を先頭に付ける）
+    @property
+    def area_options(self):
+        return ['なし'] + list(self.areas.keys())
+
+    def store_color(self, store, default=DEFAULT_STORE_COLOR):
+        return self.store_colors.get(store, default)
+
+    def __repr__(self):
+        return f'Registry(tenant={self.tenant!r}, version={self.version})'
+
+
+@lru_cache(maxsize=8)
+def _load_registry(tenant, version):
+    tables = get_master_tables()
+    return Registry(tenant, version, tables['employees'], tables['areas'], tables['stores'])
+
+
+def _latest_registry():
+    return _load_registry(current_tenant(), get_registry_version())
+
+
+# 以降のget_registryで、この時点のマスタを更新番号を確認せずに使う（画面の実行の最初に、拠点を設定してから呼ぶ）
+def pin_registry():
+    registry = _latest_registry()
+    _pinned_registry.set(registry)
+    return registry
+
+
+# with文の中だけマスタを固定する（ワーカーでPDFを生成する間など）
+@contextmanager
+def use_registry(registry):
+    token = _pinned_registry.set(registry)
+    try:
+        yield
+    finally:
+        _pinned_registry.reset(token)
+
+
+#現在の拠点のマスタを返す（固定されていなければ、更新番号が変わったときだけDBから読み直す）
+def get_registry():
+    registry = _pinned_registry.get()
+    if registry is not None and registry.tenant == current_tenant():
+        return registry
+    return _latest_registry()
@@ -0,0 +1,50 @@
+import argparse
+import sys
+from database import init_db, use_tenant, repair_period_rollups, close_connections, TENANTS
+from shift_calendar import period_key
+
+# 期間ごとの集計（period_rollups・store_fill_rollups）をシフト・ヘルプ希望の生の行から作り直し、ずれを表示する
+#     python repair_rollups.py                     # 全拠点の全期間
+#     python repair_rollups.py --tenant miyazaki --period 2024-10 --period 2024-11
+# ずれがあった場合は終了コード1を返す
+
+
+# --period の値を 'YYYY-MM' の期間キーにそろえる（'2024-8' も受け付ける）
+def period_arg(value):
+    try:
+        year, month = (int(part) for part in value.split('-'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'期間は YYYY-MM で指定してください: {value}')
+    if not 1 <= month <= 12:
+        raise argparse.ArgumentTypeError(f'月は1〜12で指定してください: {value}')
+    return period_key(year, month)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='期間ごとの集計を作り直し、保存されていた集計とのずれを表示する')
+    parser.add_argument('--tenant', action='append', choices=list(TENANTS), help='対象の拠点（省略時は全拠点）')
+    parser.add_argument('--period', action='append', type=period_arg, help='対象の期間 YYYY-MM（省略時は全期間）')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    init_db()
+    drifted = False
+    try:
+        for tenant in args.tenant or TENANTS:
+            with use_tenant(tenant):
+                drift = repair_period_rollups(args.period)
+            if drift.empty:
+                print(f'{TENANTS[tenant]}: ずれはありません')
+            else:
+                drifted = True
+                print(f'{TENANTS[tenant]}: {len(drift)}件のずれを修正しました')
+                print(drift.to_string(index=False))
+    finally:
+        close_connections()
+    return 1 if drifted else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,67 @@
+from functools import lru_cache
+import jpholiday
+import numpy as np
+import pandas as pd
+from constants import WEEKDAY_JA, HOLIDAY_BG_COLOR, SATURDAY_BG_COLOR
+
+WEEKDAY_LABELS = np.array([WEEKDAY_JA[day] for day in ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')], dtype=object)
+
+
+# 選択された月の16日から翌月15日までの期間
+def period_range(year, month):
+    start_date = pd.Timestamp(year, month, 16)
+    end_date = start_date + pd.DateOffset(months=1) - pd.Timedelta(days=1)
+    return start_date, end_date
+
+
+# data_versions などで使う期間キー（例: '2024-07'）
+def period_key(year, month):
+    return f'{year:04d}-{month:02d}'
+
+
+# 日付（'YYYY-MM-DD' またはTimestamp）が属する期間キー（15日以前は前月の期間）
+# DBへの書き込みのたびに呼ぶため、文字列はpandasを通さずに計算する
+def period_key_of(date):
+    date_str = date if isinstance(date, str) else pd.Timestamp(date).strftime('%Y-%m-%d')
+    year, month, day = int(date_str[:4]), int(date_str[5:7]), int(date_str[8:10])
+    if day < 16:
+        year, month = (year, month - 1) if month > 1 else (year - 1, 12)
+    return period_key(year, month)
+
+
+# 日付インデックスをまとめて期間キーに変換（period_key_of と同じ規則）
+def period_keys(dates):
+    return (pd.DatetimeIndex(dates) - pd.Timedelta(days=15)).strftime('%Y-%m')
+
+
+# (year, month) の期間を最後とする直近 months 期間の (年, 月) 一覧（古い順）
+def recent_periods(year, month, months):
+    months_start = pd.date_range(end=pd.Timestamp(year, month, 1), periods=months, freq='MS')
+    return [(date.year, date.month) for date in months_start]
+
+
+# 期間内の各日付の曜日・祝日・行の背景色を1度だけ計算する
+# 表示とPDFで共有するため、返したDataFrameは変更しないこと
+@lru_cache(maxsize=64)
+def period_calendar(year, month):
+    start_date, end_date = period_range(year, month)
+    dates = pd.date_range(start=start_date, end=end_date)
+    day_of_week = dates.dayofweek.to_numpy()
+    holidays = np.array([jpholiday.is_holiday(date) for date in dates], dtype=bool)
+    background = np.where((day_of_week == 6) | holidays, HOLIDAY_BG_COLOR,
+                          np.where(day_of_week == 5, SATURDAY_BG_COLOR, ''))
+    return pd.DataFrame({
+        '曜日': WEEKDAY_LABELS[day_of_week],
+        '祝日': holidays,
+        '背景色': background,
+    }, index=dates)
+
+
+# 任意の日付列に対応するカレンダー（期間ごとのキャッシュを組み合わせる）
+def calendar_for_dates(dates):
+    dates = pd.DatetimeIndex(dates).normalize()
+    periods = sorted(set(period_keys(dates)))
+    frames = [period_calendar(int(key[:4]), int(key[5:])) for key in periods]
+    if not frames:
+        return pd.DataFrame(columns=['曜日', '祝日', '背景色'], index=dates)
+    return pd.concat(frames).reindex(dates)
@@ -0,0 +1,145 @@
+from functools import lru_cache
+from typing import NamedTuple, Optional
+from constants import SPECIAL_SHIFT_TYPES
+
+AVAILABILITY_TYPES = ('AM可', 'PM可', '1日可')
+KNOWN_SHIFT_TYPES = AVAILABILITY_TYPES + tuple(SPECIAL_SHIFT_TYPES)
+
+# シフト日数の重み（calculate_shift_countで使用）
+SHIFT_WEIGHTS = {
+    '1日可': 1.0,
+    '鹿屋': 1.0,
+    'かご北': 1.0,
+    'リクルート': 1.0,
+    'AM可': 0.5,
+    'PM可': 0.5,
+}
+
+# 受付可能な時間帯（分）。自動割り当てや整合性チェックで使用
+AVAILABILITY_WINDOWS = {
+    'AM可': (0, 13 * 60 + 30),
+    'PM可': (13 * 60, 24 * 60),
+    '1日可': (0, 24 * 60),
+}
+
+PARSE_CACHE_SIZE = 4096
+
+
+#「9」「8半」「9:30」形式の時刻を分に変換（解析できない場合はNone）
+def clock_to_minutes(clock_str):
+    clock_str = clock_str.strip()
+    if not clock_str:
+        return None
+    if clock_str.endswith('半'):
+        hour_str, minute = clock_str[:-1], 30
+    elif ':' in clock_str:
+        hour_str, minute_str = clock_str.split(':', 1)
+        if not minute_str.isdigit():
+            return None
+        minute = int(minute_str)
+    else:
+        hour_str, minute = clock_str, 0
+    if not hour_str.isdigit():
+        return None
+    hour = int(hour_str)
+    if hour > 24 or minute >= 60:
+        return None
+    return hour * 60 + minute
+
+
+#「9-13」「14半-17半」形式の時間帯を(開始分, 終了分)に変換
+def parse_time_range(time_str):
+    if '-' in time_str:
+        start_str, end_str = time_str.split('-', 1)
+        return clock_to_minutes(start_str), clock_to_minutes(end_str)
+    return clock_to_minutes(time_str), None
+
+
+# 時間@店舗 の1区間
+class Segment(NamedTuple):
+    start: Optional[int]
+    end: Optional[int]
+    store: str
+    time: str
+
+
+# 解析済みのシフト（キャッシュで共有されるため生成後は変更しないこと）
+class Shift:
+    __slots__ = ('raw', 'shift_type', 'segments')
+
+    def __init__(self, raw, shift_type, segments=()):
+        self.raw = raw
+        self.shift_type = shift_type
+        self.segments = segments
+
+    @property
+    def is_empty(self):
+        return self.shift_type == '-' and not self.segments
+
+    @property
+    def is_special(self):
+        return self.shift_type in SPECIAL_SHIFT_TYPES
+
+    @property
+    def is_availability(self):
+        return self.shift_type in AVAILABILITY_TYPES
+
+    @property
+    def weight(self):
+        return SHIFT_WEIGHTS.get(self.shift_type, 0)
+
+    @property
+    def times(self):
+        return [segment.time for segment in self.segments]
+
+    @property
+    def stores(self):
+        return [segment.store for segment in self.segments]
+
+    # 店舗が指定されている区間のみ
+    @property
+    def store_segments(self):
+        return [segment for segment in self.segments if segment.store]
+
+    def __eq__(self, other):
+        if not isinstance(other, Shift):
+            return NotImplemented
+        return (self.shift_type, self.segments) == (other.shift_type, other.segments)
+
+    def __hash__(self):
+        return hash((self.shift_type, self.segments))
+
+    def __repr__(self):
+        return f'Shift({self.raw!r})'
+
+
+EMPTY_SHIFT = Shift('-', '-')
+
+
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def _parse_shift_str(shift_str):
+    parts = shift_str.split(',')
+    shift_type = parts[0].strip()
+    segments = []
+    for part in parts[1:]:
+        part = part.strip()
+        if '@' in part:
+            time, store = part.split('@', 1)
+        else:
+            time, store = part, ''
+        start, end = parse_time_range(time)
+        segments.append(Segment(start, end, store, time))
+    return Shift(shift_str, shift_type, tuple(segments))
+
+
+#シフト文字列を解析してShiftを返す（同じ文字列の解析結果はキャッシュされる）
+def parse(shift_value):
+    if not isinstance(shift_value, str) or not shift_value:
+        return EMPTY_SHIFT
+    return _parse_shift_str(shift_value)
+
+
+# シフトタイプと (時間, 店舗) の一覧からシフト文字列を組み立てる（update_shift_inputと同じ形式）
+def format_shift_str(shift_type, times_stores):
+    parts = [f'{time}@{store}' if store else time for time, store in times_stores]
+    return ','.join([shift_type] + parts) if parts else shift_type
@@ -0,0 +1,244 @@
+import queue
+import sqlite3
+import threading
+
+# database.py のクエリはSQLite・PostgreSQLの両方で動く書き方（? プレースホルダ、ON CONFLICT ... DO UPDATE）にそろえ、
+# 接続の取得・スキーマバージョンの保存場所・拠点ごとの分け方だけをバックエンドごとに実装する
+#
+# バックエンドの接続は次のように使う（with文を抜けるとコミット、例外ならロールバック）
+#     with backend.connection(tenant) as conn:
+#         conn.execute(query, params)
+#         conn.executemany(query, rows)
+
+BUSY_TIMEOUT_SECONDS = 10
+# SQLiteファイルごとに使い回す接続の数（これを超えて借りた接続は返すときに閉じる）
+SQLITE_POOL_SIZE = 4
+
+# 接続ごとに設定するPRAGMA（WALで読み書きを並行させ、ロック待ちはbusy_timeoutに任せる）
+SQLITE_PRAGMAS = [
+    'PRAGMA journal_mode = WAL',
+    'PRAGMA synchronous = NORMAL',
+    f'PRAGMA busy_timeout = {BUSY_TIMEOUT_SECONDS * 1000}',
+    'PRAGMA temp_store = MEMORY',
+    'PRAGMA cache_size = -8000',
+]
+
+
+# 1つのSQLiteファイルの接続プール
+# Streamlitは再実行のたびに別のスレッドでスクリプトを動かすため、接続はスレッドではなくファイルごとに使い回す
+class _SQLitePool:
+    def __init__(self, path, size=SQLITE_POOL_SIZE):
+        self.path = path
+        self.closed = False
+        self._idle = queue.LifoQueue(maxsize=size)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT_SECONDS, check_same_thread=False)
+        for pragma in SQLITE_PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    def acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return self._connect()
+
+    def release(self, conn):
+        if self.closed:
+            conn.close()
+            return
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def close(self):
+        self.closed = True
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+# プールから借りたSQLite接続（with文を抜けるとコミットしてプールに返す）
+# 同じスレッドでwith文が入れ子になった場合は外側の接続をそのまま使い、外側を抜けるときにまとめてコミットする
+class _SQLiteConnection:
+    def __init__(self, pool, held):
+        self._pool = pool
+        self._held = held
+        self._conn = None
+        self._outermost = False
+
+    def __enter__(self):
+        self._conn = self._held.get(self._pool.path)
+        if self._conn is None:
+            self._conn = self._held[self._pool.path] = self._pool.acquire()
+            self._outermost = True
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if not self._outermost:
+            return False
+        conn, self._conn = self._conn, None
+        del self._held[self._pool.path]
+        try:
+            if exc_type is None:
+                conn.commit()
+            else:
+                conn.rollback()
+        finally:
+            self._pool.release(conn)
+        return False
+
+    @property
+    def in_transaction(self):
+        return self._conn.in_transaction
+
+    def execute(self, query, params=()):
+        return self._conn.execute(query, params)
+
+    def executemany(self, query, rows):
+        return self._conn.executemany(query, rows)
+
+
+# 拠点ごとのSQLiteファイル（path_for(拠点) でファイルを決める）
+class SQLiteBackend:
+    name = 'sqlite'
+    serial_primary_key = 'INTEGER PRIMARY KEY AUTOINCREMENT'
+
+    def __init__(self, path_for):
+        self.path_for = path_for
+        self._pools = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _pool(self, path):
+        pool = self._pools.get(path)
+        if pool is None:
+            with self._lock:
+                pool = self._pools.setdefault(path, _SQLitePool(path))
+        return pool
+
+    def connection(self, tenant):
+        held = getattr(self._local, 'held', None)
+        if held is None:
+            held = self._local.held = {}
+        return _SQLiteConnection(self._pool(self.path_for(tenant)), held)
+
+    # 使われていない接続を閉じる（貸し出し中の接続は返されたときに閉じる）
+    def close(self):
+        with self._lock:
+            pools, self._pools = self._pools, {}
+        for pool in pools.values():
+            pool.close()
+
+    # 書き込みのトランザクションを読み込みより前に始める
+    # sqlite3は最初の書き込みまでBEGINを送らないため、そのままでは先に読んだ値が他の書き込みで古くなる
+    def begin_write(self, conn):
+        if not conn.in_transaction:
+            conn.execute('BEGIN IMMEDIATE')
+
+    def prepare_tenant(self, conn, tenant):
+        pass
+
+    def get_schema_version(self, conn):
+        return conn.execute('PRAGMA user_version').fetchone()[0]
+
+    def set_schema_version(self, conn, version):
+        conn.execute(f'PRAGMA user_version = {int(version)}')
+
+
+# プールから借りたPostgreSQL接続を sqlite3.Connection と同じ使い方にするラッパー
+class _PooledConnection:
+    def __init__(self, pool):
+        self._pool = pool
+        self._conn = None
+
+    def __enter__(self):
+        self._conn = self._pool.getconn()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        conn, self._conn = self._conn, None
+        try:
+            if exc_type is None:
+                conn.commit()
+            else:
+                conn.rollback()
+        finally:
+            self._pool.putconn(conn)
+        return False
+
+    def execute(self, query, params=()):
+        cursor = self._conn.cursor()
+        cursor.execute(query.replace('?', '%s'), tuple(params) or None)
+        return cursor
+
+    def executemany(self, query, rows):
+        from psycopg2.extras import execute_batch
+        cursor = self._conn.cursor()
+        rows = list(rows)
+        if rows:
+            execute_batch(cursor, query.replace('?', '%s'), rows, page_size=500)
+        return cursor
+
+
+# 1つのPostgreSQLを複数のアプリから共有する。拠点ごとにスキーマとコネクションプールを分ける
+class PostgresBackend:
+    name = 'postgres'
+    serial_primary_key = 'BIGSERIAL PRIMARY KEY'
+
+    def __init__(self, dsn, min_connections=1, max_connections=10):
+        self.dsn = dsn
+        self.min_connections = min_connections
+        self.max_connections = max_connections
+        self._pools = {}
+        self._lock = threading.Lock()
+
+    def _pool(self, tenant):
+        pool = self._pools.get(tenant)
+        if pool is None:
+            from psycopg2.pool import ThreadedConnectionPool
+            with self._lock:
+                pool = self._pools.get(tenant)
+                if pool is None:
+                    pool = self._pools[tenant] = ThreadedConnectionPool(
+                        self.min_connections, self.max_connections, self.dsn,
+                        options=f'-c search_path={tenant}')
+        return pool
+
+    # 借りた接続はwith文を抜けるとプールに返される
+    def connection(self, tenant):
+        return _PooledConnection(self._pool(tenant))
+
+    def close(self):
+        with self._lock:
+            for pool in self._pools.values():
+                pool.closeall()
+            self._pools.clear()
+
+    # トランザクションは接続を借りた時点で始まっている
+    # 同じ期間への書き込みは、database.py が最初に更新するdata_versionsの行ロックで1つずつになる
+    def begin_write(self, conn):
+        pass
+
+    def prepare_tenant(self, conn, tenant):
+        conn.execute(f'CREATE SCHEMA IF NOT EXISTS {tenant}')
+        conn.execute('CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)')
+
+    def get_schema_version(self, conn):
+        row = conn.execute('SELECT version FROM schema_version').fetchone()
+        return row[0] if row else 0
+
+    def set_schema_version(self, conn, version):
+        conn.execute('DELETE FROM schema_version')
+        conn.execute('INSERT INTO schema_version (version) VALUES (?)', (int(version),))
+
+
+# DATABASE_URL が postgres:// / postgresql:// ならPostgreSQL、それ以外はSQLiteファイルを使う
+def create_backend(database_url, sqlite_path_for):
+    if database_url and database_url.startswith(('postgres://', 'postgresql://')):
+        return PostgresBackend(database_url)
+    return SQLiteBackend(sqlite_path_for)
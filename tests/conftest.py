@@ -0,0 +1,44 @@
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+from storage import SQLiteBackend, PostgresBackend
+
+# PostgreSQLでも動かすときは、テスト専用のDBを TEST_DATABASE_URL に指定する（拠点のスキーマは毎回作り直す）
+#     TEST_DATABASE_URL=postgresql://postgres@localhost/shifts_test python -m pytest tests
+TEST_DATABASE_URL = os.environ.get('TEST_DATABASE_URL')
+
+
+def _drop_tenant_schemas(backend):
+    for tenant in database.TENANTS:
+        with backend.connection(tenant) as conn:
+            conn.execute(f'DROP SCHEMA IF EXISTS {tenant} CASCADE')
+    backend.close()
+
+
+# 空のSQLiteファイル／PostgreSQLのスキーマに切り替えたdatabaseモジュール（init_dbはテストごとに呼ぶ）
+@pytest.fixture(params=['sqlite', 'postgres'])
+def empty_db(request, tmp_path, monkeypatch):
+    if request.param == 'sqlite':
+        monkeypatch.setattr(database, 'DB_NAME', str(tmp_path / 'shifts.db'))
+        backend = SQLiteBackend(database.db_path)
+    else:
+        if not TEST_DATABASE_URL:
+            pytest.skip('TEST_DATABASE_URL が設定されていません')
+        backend = PostgresBackend(TEST_DATABASE_URL)
+        _drop_tenant_schemas(backend)
+    monkeypatch.setattr(database, 'BACKEND', backend)
+    with database.use_tenant(database.DEFAULT_TENANT):
+        yield database
+    if request.param == 'postgres':
+        _drop_tenant_schemas(backend)
+    backend.close()
+
+
+@pytest.fixture
+def db(empty_db):
+    empty_db.init_db()
+    return empty_db
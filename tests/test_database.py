@@ -0,0 +1,173 @@
+import pandas as pd
+import pytest
+from constants import EMPLOYEES
+from shift_calendar import period_range
+
+YEAR, MONTH = 2024, 8
+START, END = period_range(YEAR, MONTH)
+SADO, OTSUKA = EMPLOYEES[0], EMPLOYEES[1]
+
+
+def _shift(db, date, employee):
+    shifts = db.get_shifts(START, END)
+    return shifts.loc[pd.Timestamp(date), employee]
+
+
+def test_init_db_creates_latest_schema_and_masters(empty_db):
+    empty_db.init_db()
+    empty_db.init_db()
+    with empty_db.get_connection() as conn:
+        assert empty_db.BACKEND.get_schema_version(conn) == len(empty_db.MIGRATIONS)
+    assert list(empty_db.get_master_tables()['employees']['name']) == EMPLOYEES
+
+
+# 移行前（shifts・store_help_requestsだけ）のDBに、区間・履歴・期間の列・変更履歴の番号が作られる
+def test_init_db_migrates_legacy_tables(empty_db):
+    with empty_db.get_connection() as conn:
+        empty_db.BACKEND.prepare_tenant(conn, empty_db.current_tenant())
+        conn.execute('CREATE TABLE shifts (date TEXT, employee TEXT, shift TEXT, PRIMARY KEY (date, employee))')
+        conn.execute('CREATE TABLE store_help_requests (date TEXT, store TEXT, help_time TEXT, PRIMARY KEY (date, store))')
+        conn.execute('INSERT INTO shifts (date, employee, shift) VALUES (?, ?, ?)', ('2024-08-20', OTSUKA, '1日可,9-13@本店'))
+        conn.execute('INSERT INTO store_help_requests (date, store, help_time) VALUES (?, ?, ?)', ('2024-08-20', '本店', '9-13'))
+    empty_db.init_db()
+
+    segments = empty_db.get_shift_segments(START, END)
+    assert segments[['employee', 'start_min', 'end_min', 'store']].values.tolist() == [[OTSUKA, 540, 780, '本店']]
+    assert list(empty_db.get_history(empty_db.CHANGE_KIND_SHIFT, '2024-08-20', OTSUKA)['value']) == ['1日可,9-13@本店']
+    with empty_db.get_connection() as conn:
+        assert conn.execute('SELECT shift_type, period FROM shifts').fetchall() == [('1日可', '2024-08')]
+        assert conn.execute('SELECT period FROM store_help_requests').fetchall() == [('2024-08',)]
+        assert conn.execute('SELECT period, version FROM change_log').fetchall() == []
+
+
+def test_save_shift_upserts_cell(db):
+    db.save_shift('2024-08-20', OTSUKA, '1日可,9-13@本店')
+    db.save_shift('2024-08-20', OTSUKA, 'AM可,9-12@武店')
+
+    assert _shift(db, '2024-08-20', OTSUKA) == 'AM可,9-12@武店'
+    assert db.get_shift_segments(START, END)[['employee', 'store']].values.tolist() == [[OTSUKA, '武店']]
+    assert db.get_data_version(YEAR, MONTH) == 2
+    assert list(db.get_history(db.CHANGE_KIND_SHIFT, '2024-08-20', OTSUKA)['value']) == ['AM可,9-12@武店', '1日可,9-13@本店']
+
+
+def test_save_shifts_bulk_accepts_long_and_wide_tables(db):
+    long_rows = pd.DataFrame({'date': ['2024-08-20', '2024-08-21', '2024-08-20'],
+                              'employee': [OTSUKA, SADO, OTSUKA],
+                              'shift': ['AM可', '休み', 'PM可']})
+    # 同じセルは後の行を優先する
+    assert db.save_shifts_bulk(long_rows) == 2
+    wide_rows = pd.DataFrame({'日付': ['2024-08-22', '2024-08-23'], '曜日': ['木', '金'],
+                              OTSUKA: ['1日可,9-13@本店', None], SADO: ['AM可', 'PM可']})
+    assert db.save_shifts_bulk(wide_rows) == 3
+
+    assert _shift(db, '2024-08-20', OTSUKA) == 'PM可'
+    assert _shift(db, '2024-08-22', OTSUKA) == '1日可,9-13@本店'
+    assert _shift(db, '2024-08-23', SADO) == 'PM可'
+    assert db.get_data_version(YEAR, MONTH) == 2
+
+
+def test_save_shifts_bulk_rejects_unknown_employee_without_writing(db):
+    with pytest.raises(ValueError):
+        db.save_shifts_bulk([('2024-08-20', OTSUKA, 'AM可'), ('2024-08-20', '未登録', 'AM可')])
+    # 横持ちの表の列名の書き間違いも取り込まずにエラーにする
+    with pytest.raises(ValueError):
+        db.save_shifts_bulk(pd.DataFrame({'日付': ['2024-08-20'], OTSUKA: ['AM可'], OTSUKA + 'さん': ['PM可']}))
+    assert db.get_shifts(START, END).empty
+    assert db.get_data_version(YEAR, MONTH) == 0
+
+
+def test_save_store_help_requests_bulk_upserts(db):
+    assert db.save_store_help_requests_bulk([('2024-08-20', '本店', '9-13'), ('2024-08-21', '武店', '13-17')]) == 2
+    db.save_store_help_request('2024-08-20', '本店', '10-12')
+
+    rows = db.get_store_help_request_rows(START, END)
+    assert sorted(rows[['store', 'help_time']].values.tolist()) == [['本店', '10-12'], ['武店', '13-17']]
+    assert db.get_data_version(YEAR, MONTH) == 2
+
+
+# 期間の更新番号の続きから、その後の変更だけを古い順に読める
+def test_period_changes_follow_data_versions(db):
+    db.save_shifts_bulk([('2024-08-20', OTSUKA, 'AM可')])
+    base_version = db.get_data_version(YEAR, MONTH)
+    base = db.get_shifts(START, END)
+    db.save_store_help_request('2024-08-21', '本店', '9-13')
+    db.save_shifts_bulk([('2024-08-20', OTSUKA, 'PM可'), ('2024-07-01', SADO, '休み')])
+    version = db.get_data_version(YEAR, MONTH)
+
+    changes = db.get_period_changes(YEAR, MONTH, base_version, version)
+    assert changes[['kind', 'date', 'key', 'value', 'version']].values.tolist() == [
+        [db.CHANGE_KIND_HELP_REQUEST, '2024-08-21', '本店', '9-13', base_version + 1],
+        [db.CHANGE_KIND_SHIFT, '2024-08-20', OTSUKA, 'PM可', base_version + 2],
+    ]
+    merged = db.merge_shift_changes(base, changes)
+    assert merged.loc[pd.Timestamp('2024-08-20'), OTSUKA] == 'PM可'
+    assert base.loc[pd.Timestamp('2024-08-20'), OTSUKA] == 'AM可'
+    assert db.get_period_changes(YEAR, MONTH, version, version).empty
+
+
+# 途中の番号の変更が消えている場合はNone（呼び出し側で読み直す）
+def test_period_changes_report_gaps(db):
+    for shift_str in ['AM可', 'PM可', '1日可']:
+        db.save_shift('2024-08-20', OTSUKA, shift_str)
+    with db.get_connection() as conn:
+        conn.execute('DELETE FROM change_log WHERE period = ? AND version = ?', ('2024-08', 2))
+
+    assert db.get_period_changes(YEAR, MONTH, 0, 3) is None
+    assert len(db.get_period_changes(YEAR, MONTH, 2, 3)) == 1
+
+
+def test_tenants_do_not_share_data(db):
+    db.save_shift('2024-08-20', OTSUKA, 'AM可')
+    with db.use_tenant('miyazaki'):
+        assert db.get_shifts(START, END).empty
+        assert db.get_data_version(YEAR, MONTH) == 0
+        assert db.get_period_changes(YEAR, MONTH, 0, 0).empty
+
+
+# マスタ設定の画面と同じく、activeをboolにした表を保存して読み直す
+def test_save_master_tables_round_trip(db):
+    tables = db.get_master_tables()
+    for table in tables.values():
+        table['active'] = table['active'].astype(bool)
+    employees = tables['employees']
+    employees.loc[employees['name'] == SADO, 'active'] = False
+    employees = pd.concat([employees, pd.DataFrame({'name': ['新人'], 'sort_order': [99.0], 'active': [True]})],
+                          ignore_index=True)
+    version = db.get_registry_version()
+    db.save_master_tables({'employees': employees, 'stores': tables['stores']})
+
+    saved = db.get_master_tables()
+    assert saved['employees'].set_index('name')['active'].to_dict() == {
+        **{name: 1 for name in EMPLOYEES}, SADO: 0, '新人': 1}
+    assert saved['employees']['name'].iloc[-1] == '新人'
+    assert saved['stores'].values.tolist() == tables['stores'].astype({'active': int}).values.tolist()
+    assert db.get_registry_version() == version + 1
+
+
+# 書き込みのたびに差分で更新した集計が、生の行から作り直した集計と一致する
+def test_rollup_deltas_match_rebuild(db):
+    db.save_shifts_bulk([('2024-08-20', OTSUKA, '1日可,9-13@本店'), ('2024-08-21', SADO, 'AM可'),
+                         ('2024-08-10', OTSUKA, 'PM可,13-17@郡山店')])
+    db.save_store_help_requests_bulk([('2024-08-20', '本店', '9-13'), ('2024-08-22', '武店', '13-17')])
+    assert sorted(db.refresh_period_rollups(['2024-07', '2024-08'])) == ['2024-07', '2024-08']
+
+    db.save_shift('2024-08-20', OTSUKA, '1日可,9-12@本店,13-17@武店')
+    db.save_shift('2024-08-21', SADO, 'PM可')
+    db.save_shifts_bulk([('2024-08-22', OTSUKA, '1日可,9-13@武店,14-17@郡山店,17-18@武店'),
+                         ('2024-08-20', SADO, '休み'),
+                         ('2024-08-10', OTSUKA, '1日可'),
+                         ('2024-08-20', OTSUKA, 'AM可,9-12@本店')])
+    db.save_shift('2024-08-22', OTSUKA, 'PM可,13-15@大王店,15-17@武店')
+    db.save_store_help_request('2024-08-23', '大王店', '13-17')
+
+    assert db.refresh_period_rollups(['2024-07', '2024-08']) == []
+    assert db.repair_period_rollups().empty
+
+
+def test_repair_rollups_normalizes_period(db):
+    import repair_rollups
+    db.save_shift('2024-08-20', OTSUKA, '1日可,9-13@本店')
+    db.refresh_period_rollups(['2024-08'])
+    assert repair_rollups.main(['--tenant', 'kagoshima', '--period', '2024-8']) == 0
+    with pytest.raises(SystemExit):
+        repair_rollups.parse_args(['--period', '2024-13'])
@@ -1,30 +1,23 @@
+from functools import lru_cache, partial
+import numpy as np
 import pandas as pd
-import streamlit as st
-import jpholiday
-from constants import AREAS, SHIFT_TYPES, STORE_COLORS, FILLED_HELP_BG_COLOR, SATURDAY_BG_COLOR,HOLIDAY_BG_COLOR, KANOYA_BG_COLOR, KAGOKITA_BG_COLOR,RECRUIT_BG_COLOR
+import shift_model
+from shift_model import KNOWN_SHIFT_TYPES, SHIFT_WEIGHTS
+from shift_calendar import calendar_for_dates
+from registry import get_registry
+from constants import SHIFT_TYPES, FILLED_HELP_BG_COLOR, HOLIDAY_BG_COLOR, KANOYA_BG_COLOR, KAGOKITA_BG_COLOR,RECRUIT_BG_COLOR
 
 #シフト文字列を解析し、シフトタイプ、時間、店舗に分割
 def parse_shift(shift_str):
     if pd.isna(shift_str) or shift_str in ['-', '休み', '鹿屋', 'かご北', 'リクルート'] or isinstance(shift_str, (int, float)):
         return shift_str, [], []
-    try:
-        parts = str(shift_str).split(',')
-        shift_type = parts[0] if parts[0] in ['AM可', 'PM可', '1日可', '休み', '鹿屋', 'かご北', 'リクルート'] else ''
-        times_stores = []
-        for part in parts[1:]:
-            if '@' in part:
-                time, store = part.strip().split('@')
-                times_stores.append((time, store))
-            else:
-                times_stores.append((part.strip(), ''))
-        times, stores = zip(*times_stores) if times_stores else ([], [])
-        return shift_type, list(times), list(stores)
-    except:
-        return '-', [], []
+    shift = shift_model.parse(str(shift_str))
+    shift_type = shift.shift_type if shift.shift_type in KNOWN_SHIFT_TYPES else ''
+    return shift_type, shift.times, shift.stores
     
 
-#シフトデータを表示用にフォーマット
-def format_shifts(val):
+#シフトデータを表示用にフォーマット（store_colorsを省略すると現在の拠点のマスタの色を使う）
+def format_shifts(val, store_colors=None):
     if pd.isna(val) or val == '-' or isinstance(val, (int, float)):
         return val
     if val == '休み':
@@ -36,81 +29,157 @@ def format_shifts(val):
     
     if val == 'リクルート':
         return f'<div style="background-color: {RECRUIT_BG_COLOR};">{val}</div>'
-    try:
-        parts = str(val).split(',')
-        shift_type = parts[0]
-        formatted_shifts = []
-        
-        for part in parts[1:]:
-            if '@' in part:
-                time, store = part.strip().split('@')
-                color = STORE_COLORS.get(store, "#000000")
-                formatted_shifts.append(f'<span style="color: {color}">{time}@{store}</span>')
-            else:
-                formatted_shifts.append(part.strip())
-        
-        if shift_type in ['AM可', 'PM可', '1日可']:
-            if formatted_shifts:
-                return f'<div style="white-space: pre-line;">{shift_type}\n{chr(10).join(formatted_shifts)}</div>'
-            else:
-                return shift_type
+    shift = shift_model.parse(str(val))
+    formatted_shifts = []
+    store_colors = get_registry().store_colors if store_colors is None else store_colors
+
+    for segment in shift.segments:
+        if segment.store:
+            color = store_colors.get(segment.store, "#000000")
+            formatted_shifts.append(f'<span style="color: {color}">{segment.time}@{segment.store}</span>')
+        else:
+            formatted_shifts.append(segment.time)
+
+    if shift.is_availability:
+        if formatted_shifts:
+            return f'<div style="white-space: pre-line;">{shift.shift_type}\n{chr(10).join(formatted_shifts)}</div>'
         else:
-            return f'<div style="white-space: pre-line;">{chr(10).join(formatted_shifts)}</div>' if formatted_shifts else '-'
-    except Exception as e:
-        print(f"Error formatting shift: {val}. Error: {e}")
-        return str(val)
+            return shift.shift_type
+    else:
+        return f'<div style="white-space: pre-line;">{chr(10).join(formatted_shifts)}</div>' if formatted_shifts else '-'
     
-#セッション状態のシフトデータを更新
-def update_session_state_shifts(shifts):
-    for date, row in shifts.iterrows():
-        if date in st.session_state.shift_data.index:
-            for employee, shift in row.items():
-                if pd.notna(shift):
-                    st.session_state.shift_data.loc[date, employee] = str(shift)
-                else:
-                    st.session_state.shift_data.loc[date, employee] = '-'
-
-#土曜日と日曜日の行に背景色を適用
-def is_holiday(date):
-    return jpholiday.is_holiday(date)
-
-def highlight_weekend_and_holiday(row):
-    weekday = row['曜日']
-    date = pd.to_datetime(row['日付'])
-    if weekday == '日' or is_holiday(date):
-        return ['background-color: ' + HOLIDAY_BG_COLOR] * len(row)
-    elif weekday == '土':
-        return ['background-color: ' + SATURDAY_BG_COLOR] * len(row)
-    return [''] * len(row)
+#土曜日と日曜日・祝日の行に背景色を適用（Styler.apply(axis=None) 用）
+def highlight_weekend_and_holiday(df):
+    background = calendar_for_dates(pd.to_datetime(df['日付']))['背景色'].fillna('').to_numpy()
+    styles = np.where(background != '', 'background-color: ' + background.astype(object), '')
+    return pd.DataFrame(np.repeat(styles[:, None], df.shape[1], axis=1), index=df.index, columns=df.columns)
+
+
+#マスタごとのformat_shifts（店舗の色は拠点・マスタの更新番号ごとに違うため、結果もマスタごとにキャッシュする）
+@lru_cache(maxsize=8)
+def shift_formatter(registry):
+    return lru_cache(maxsize=4096)(partial(format_shifts, store_colors=registry.store_colors))
 
 
 def get_store_index(store):
-    all_stores = [s for stores in AREAS.values() for s in stores]
-    return all_stores.index(store) if store in all_stores else 0
+    return get_registry().store_index.get(store, 0)
 
 def get_shift_type_index(shift_type):
     return SHIFT_TYPES.index(shift_type) if shift_type in SHIFT_TYPES else 0
 
 
-#シフトが埋まっているかどうかをチェック
-def is_shift_filled(shift):
-    if pd.isna(shift) or shift == '-':
-        return False, []
-    shift_type, times, stores = parse_shift(shift)
-    return bool(times and stores), stores
+#日付→ヘルプに入っている店舗の集合（1か月分を1度だけ作る。店舗名は完全一致で判定）
+def build_covered_stores_index(shift_data):
+    covered_stores = {}
+    for date, row in zip(shift_data.index, shift_data.to_numpy()):
+        stores = set()
+        for shift in row:
+            if isinstance(shift, str):
+                stores.update(segment.store for segment in shift_model.parse(shift).store_segments if segment.time)
+        covered_stores[date] = frozenset(stores)
+    return covered_stores
 
 
-#埋まっているシフトをハイライト
-def highlight_filled_shifts(row, shift_data):
-    styles = [''] * len(row)
-    date = pd.to_datetime(row['日付'])
-    if date not in shift_data.index:
-        return styles
-    
-    all_stores = [store for stores in AREAS.values() for store in stores]
-    for i, store in enumerate(all_stores):
-        if store in row.index:
-            store_shifts = shift_data.loc[date]
-            if any(is_shift_filled(shift) and store in shift for shift in store_shifts if pd.notna(shift)):
-                styles[row.index.get_loc(store)] = FILLED_HELP_BG_COLOR
-    return styles
\ No newline at end of file
+#埋まっているシフトをハイライト（Styler.apply(axis=None) 用、covered_storesはbuild_covered_stores_indexの結果）
+def highlight_filled_shifts(df, covered_stores):
+    styles = pd.DataFrame('', index=df.index, columns=df.columns)
+    covered = [covered_stores.get(date, frozenset()) for date in pd.to_datetime(df['日付'])]
+    store_areas = get_registry().store_areas
+    for store in df.columns:
+        if store in store_areas:
+            styles.loc[[store in stores for stores in covered], store] = FILLED_HELP_BG_COLOR
+    return styles
+
+
+#アップロードされたCSV/Excelを日付インデックスのDataFrameとして読み込む
+def read_uploaded_table(uploaded_file):
+    if uploaded_file.name.lower().endswith(('.xlsx', '.xlsm')):
+        df = pd.read_excel(uploaded_file, engine='openpyxl', dtype=str)
+    else:
+        df = pd.read_csv(uploaded_file, dtype=str, encoding='utf-8-sig')
+    df.columns = [str(column).strip() for column in df.columns]
+    if 'date' in df.columns:
+        return df
+    date_column = '日付' if '日付' in df.columns else df.columns[0]
+    df = df.set_index(date_column)
+    df.index = pd.to_datetime(df.index)
+    return df.drop(columns=['曜日'], errors='ignore')
+
+
+#全セルのシフト日数の重み（1日:1 / AM・PM:0.5 / その他:0）をまとめて求める
+#セルごとに解析せず、重複を除いたシフト文字列（カテゴリ）単位で種類を判定する
+def shift_weights(shift_data):
+    categories = pd.Categorical(shift_data.to_numpy().ravel())
+    category_weights = categories.categories.astype(str).str.split(',', n=1).str[0].str.strip().map(SHIFT_WEIGHTS)
+    lookup = np.append(np.nan_to_num(np.asarray(category_weights, dtype=float)), 0.0)  # 欠損（コード-1）は0
+    weights = lookup[categories.codes].reshape(shift_data.shape)
+    return pd.DataFrame(weights, index=shift_data.index, columns=shift_data.columns)
+
+
+#従業員ごとのシフト日数
+def calculate_shift_count(shift_data):
+    return shift_weights(shift_data).sum()
+
+
+#日付×従業員のシフトから、指定した日付の行だけを持つ表示用データ（日付・曜日＋従業員列）を作る
+def build_display_frame(shifts, dates):
+    display_data = shifts.reindex(index=dates, columns=list(get_registry().employees)).fillna('-')
+    display_data.insert(0, '曜日', calendar_for_dates(dates)['曜日'].to_numpy())
+    display_data.insert(0, '日付', dates.strftime('%Y-%m-%d'))
+    return display_data
+
+
+#シフトをHTMLを使わない1行のテキストにする（スクロール表示のグリッド用）
+@lru_cache(maxsize=4096)
+def format_shift_text(val):
+    if not isinstance(val, str):
+        return '-'
+    shift = shift_model.parse(val)
+    if not shift.segments:
+        return shift.shift_type
+    parts = [f'{segment.time}@{segment.store}' if segment.store else segment.time for segment in shift.segments]
+    return ' / '.join(([shift.shift_type] if shift.is_availability else []) + parts)
+
+
+#日付×キーの2つの表を比べ、値が違うセルを (日付, キー, 変更前, 変更後) の一覧にする
+def diff_snapshots(before, after, key_label='従業員'):
+    index = before.index.union(after.index)
+    columns = before.columns.union(after.columns, sort=False)
+    before = before.reindex(index=index, columns=columns).fillna('-')
+    after = after.reindex(index=index, columns=columns).fillna('-')
+    changed = (before != after).stack()
+    changed = changed[changed]
+    dates = changed.index.get_level_values(0)
+    keys = changed.index.get_level_values(1)
+    return pd.DataFrame({
+        '日付': pd.DatetimeIndex(dates).strftime('%Y-%m-%d'),
+        key_label: keys,
+        '変更前': [before.at[date, key] for date, key in zip(dates, keys)],
+        '変更後': [after.at[date, key] for date, key in zip(dates, keys)],
+    })
+
+
+#同じ形の2つのCSS文字列のDataFrameをセルごとに連結
+def combine_styles(first, second):
+    joined = first + '; ' + second
+    return joined.where((first != '') & (second != ''), first + second)
+
+
+#DataFrameをStylerを使わずにHTMLのtableに変換（インデックスは出力しない）
+#stylesは同じ形のCSS文字列のDataFrame、formattersは列名→表示用関数
+def build_html_table(df, styles=None, formatters=None):
+    formatters = formatters or {}
+    column_formatters = [formatters.get(column) for column in df.columns]
+    style_values = styles.to_numpy() if styles is not None else None
+
+    header = ''.join(f'<th>{column}</th>' for column in df.columns)
+    rows = []
+    for i, values in enumerate(df.itertuples(index=False, name=None)):
+        cells = []
+        for j, value in enumerate(values):
+            formatter = column_formatters[j]
+            text = formatter(value) if formatter else value
+            style = style_values[i, j] if style_values is not None else ''
+            cells.append(f'<td style="{style}">{text}</td>' if style else f'<td>{text}</td>')
+        rows.append(f'<tr>{"".join(cells)}</tr>')
+    return f'<table><thead><tr>{header}</tr></thead><tbody>{"".join(rows)}</tbody></table>'
@@ -0,0 +1,75 @@
+import pandas as pd
+import shift_model
+from database import shift_records
+from registry import get_registry
+from shift_model import AVAILABILITY_WINDOWS
+
+ISSUE_COLUMNS = ['date', 'employee', 'kind', 'detail']
+SEGMENT_COLUMNS = ['date', 'employee', 'start_min', 'end_min', 'store', 'time']
+
+
+# シフト表（日付×従業員）から (date, employee, shift_type) の縦持ちを作る
+def shift_types_from_data(shift_data):
+    stacked = shift_data.stack()
+    stacked.index.names = ['date', 'employee']
+    types = stacked.map(lambda shift_str: shift_model.parse(shift_str).shift_type)
+    return types.rename('shift_type').reset_index()
+
+
+# 区間の重複・受付時間外・同日のエリアをまたぐ移動をまとめて検出する
+# segmentsは get_shift_segments と同じ列、shift_typesは (date, employee, shift_type)
+def find_conflicts(segments, shift_types):
+    segments = segments.dropna(subset=['start_min', 'end_min'])
+    if segments.empty:
+        return pd.DataFrame(columns=ISSUE_COLUMNS)
+    segments = segments.sort_values(['date', 'employee', 'start_min', 'end_min'], ignore_index=True)
+    issues = []
+
+    # 重複: 同じ人の直前までの区間の最大終了時刻より前に始まる区間
+    previous_end = segments.groupby(['date', 'employee'])['end_min'].transform(lambda end: end.cummax().shift())
+    overlaps = segments[segments['start_min'] < previous_end]
+    issues += [(row.date, row.employee, '重複', f'{row.time}@{row.store} が他の区間と重なっています')
+               for row in overlaps.itertuples(index=False)]
+
+    # 受付時間外: AM可/PM可/1日可の時間帯からはみ出している区間、または受付不可の日の区間
+    typed = segments.merge(shift_types, on=['date', 'employee'], how='left')
+    windows = typed['shift_type'].map(AVAILABILITY_WINDOWS)
+    window_start = windows.map(lambda window: window[0] if isinstance(window, tuple) else None)
+    window_end = windows.map(lambda window: window[1] if isinstance(window, tuple) else None)
+    outside = typed[window_start.isna() | (typed['start_min'] < window_start) | (typed['end_min'] > window_end)]
+    issues += [(row.date, row.employee, '受付時間外', f'{row.shift_type} に {row.time}@{row.store} が入っています')
+               for row in outside.itertuples(index=False)]
+
+    # エリア移動: 同じ日に別エリアの店舗へ入っている
+    areas = segments.assign(area=segments['store'].map(dict(get_registry().store_areas))).dropna(subset=['area'])
+    area_sets = areas.groupby(['date', 'employee'])['area'].unique()
+    issues += [(date, employee, 'エリア移動', '・'.join(area_list))
+               for (date, employee), area_list in area_sets.items() if len(area_list) > 1]
+
+    return pd.DataFrame(issues, columns=ISSUE_COLUMNS).sort_values(['date', 'employee'], ignore_index=True)
+
+
+# 書き込むシフトの行（save_shifts_bulk と同じ形式）のセルだけを検査する
+# 検査はすべて (日付, 従業員) ごとに閉じているので、触ったセルだけを見れば足りる
+def validate_shift_rows(rows):
+    segments = []
+    shift_types = []
+    for date_str, employee, shift_str in shift_records(rows):
+        date = pd.Timestamp(date_str)
+        shift = shift_model.parse(shift_str)
+        segments += [(date, employee, segment.start, segment.end, segment.store, segment.time)
+                     for segment in shift.store_segments]
+        shift_types.append((date, employee, shift.shift_type))
+    return find_conflicts(pd.DataFrame(segments, columns=SEGMENT_COLUMNS),
+                          pd.DataFrame(shift_types, columns=['date', 'employee', 'shift_type']))
+
+
+# 保存しようとしている (日付, 従業員) のシフトだけを検査する
+def validate_shift(date, employee, shift_str):
+    issues = validate_shift_rows([(date, employee, shift_str)])
+    return [f"{row.kind}: {row.detail}" for row in issues.itertuples(index=False)]
+
+
+# 1か月分をまとめて検査する（segmentsは get_shift_segments の結果）
+def validate_month(shift_data, segments):
+    return find_conflicts(segments, shift_types_from_data(shift_data))